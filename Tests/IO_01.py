@@ -1,7 +1,8 @@
 import pygame as pg
+import os
 import sys
 
-sys.path.append("../Music Player 2.1")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import ioMethods as io
 
 pg.init()
@@ -0,0 +1,325 @@
+# Headless benchmarks for the widgets, the player screen, track switching, library scans,
+# search, the playlist's memory use, waveforms and loudness.
+# Runs on SDL's dummy video and audio drivers against generated silent tracks and
+# prints the results as JSON, so runs can be compared to catch regressions.
+#
+# Usage: python Tests/bench.py [--sizes 1000,10000,100000] [--out results.json]
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import contextlib
+import tracemalloc
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pygame as pg
+
+# ---- Fixtures ---- #
+# One silent MPEG-1 Layer III frame: 128kbps, 44.1kHz, mono, all-zero side info and data
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+# A much smaller frame for the big scan folders: 32kbps, 48kHz, mono
+TINY_MP3_FRAME = bytes([0xFF, 0xFB, 0x14, 0xC0]) + bytes(92)
+
+def writeSilentMP3(path, seconds, frame=MP3_FRAME, samplesPerFrame=1152, sampleRate=44100):
+    with open(path, "wb") as f:
+        f.write(frame * max(1, int(seconds * sampleRate / samplesPerFrame)))
+
+def writeSilentWAV(path, seconds, sampleRate=44100):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sampleRate)
+        w.writeframes(bytes(2 * int(seconds * sampleRate)))
+
+# A folder of "count" tiny tracks for scanning
+def makeLibrary(folder, count):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        writeSilentMP3(os.path.join(folder, f"track{i:06d}.mp3"), 0.2, TINY_MP3_FRAME, 1152, 48000)
+
+# ---- Timing ---- #
+results = []
+
+# Time "func" over "runs" calls and record the stats in ms
+def bench(name, func, runs=200, **info):
+    func()  # Warm up
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    result = {
+        "Name": name,
+        "Runs": runs,
+        "MeanMs": statistics.fmean(times),
+        "MinMs": times[0],
+        "P95Ms": times[int(len(times) * 0.95) - 1] if len(times) > 1 else times[0],
+        **info
+    }
+    results.append(result)
+    print(f"{name}: {result['MeanMs']:.3f} ms mean", file=sys.stderr)
+    return result
+
+# Record a single measurement that can't be repeated cheaply
+def record(name, ms, **info):
+    results.append({"Name": name, "Runs": 1, "MeanMs": ms, "MinMs": ms, "P95Ms": ms, **info})
+    print(f"{name}: {ms:.3f} ms", file=sys.stderr)
+
+# ---- Benchmarks ---- #
+# How long each step of importing the player took, up to where it would draw its first frame.
+# Pygame is already imported by then, so "Imports" only covers the player's own modules.
+def benchStartup(main):
+    for name, start, end in main.startup.steps:
+        record(f"startup {name}", (end - start) * 1000)
+
+def benchWidgets(io, screen):
+    # Both cases render the same kind of string, so the only difference is the cache
+    label = io.text(0, 0, "00:00:00000", 2)
+    bench("text.draw cached", lambda: label.draw(screen), 2000)
+
+    counter = [0]
+    def changingText():
+        counter[0] += 1
+        label.setText(f"00:00:{counter[0] % 100000:05d}")
+        label.draw(screen)
+    bench("text.setText+draw uncached", changingText, 2000)
+
+    box = io.inputBox(0, 0)
+    box.active = True
+    keys = [pg.event.Event(pg.KEYDOWN, key=pg.K_a, mod=0, unicode="a"),
+            pg.event.Event(pg.KEYDOWN, key=pg.K_BACKSPACE, mod=0, unicode="")]
+    def typing():
+        for event in keys:
+            box.handleEvent(event)
+    bench("inputBox.handleEvent", typing, 2000)
+
+def benchPlayer(main, tracks):
+    # The same kind of playlist the player builds, so track switches go through it
+    main.playlist = main.pathTable(tracks)
+    main.playerRender.fps = 0  # Don't sleep between frames
+
+    def fullFrame():
+        main.playerRender.invalidate()
+        main.playerRender.render()
+    bench("musicPlayerUI full frame", fullFrame, 500)
+    bench("musicPlayerUI idle frame", main.playerRender.render, 2000)
+
+    def tick():
+        main.minTime.setText(f"00:00:{time.perf_counter_ns() % 60:02d}")
+        main.progBar.setValue(time.perf_counter_ns() % 100)
+        main.playerRender.render()
+    bench("musicPlayerUI playing frame", tick, 2000)
+
+    # Track switches: from asking for a track to it playing, and the UI thread's share of that
+    switchTimes = []
+    uiTimes = []
+    for i in range(40):
+        ID = i % len(tracks)
+        start = time.perf_counter()
+        main.playSong(ID)
+        while True:
+            event = pg.event.wait(2000)
+            if event.type == main.TRACK_READY and event.kind == "Play":
+                uiStart = time.perf_counter()
+                main.trackReady(event)
+                uiTimes.append((time.perf_counter() - uiStart) * 1000)
+                break
+            if event.type == pg.NOEVENT:
+                raise RuntimeError("Timed out waiting for a track to load")
+        switchTimes.append((time.perf_counter() - start) * 1000)
+    record("playSong switch latency", statistics.fmean(switchTimes), Runs=len(switchTimes))
+    record("playSong UI thread time", statistics.fmean(uiTimes), Runs=len(uiTimes))
+
+def benchScans(libraryModule, workDir, sizes):
+    for size in sizes:
+        folder = os.path.join(workDir, f"scan{size}")
+        makeLibrary(folder, size)
+        lib = libraryModule.library(os.path.join(workDir, f"scan{size}.db"))
+
+        for name in ("cold", "warm"):
+            start = time.perf_counter()
+            scan = libraryModule.scanner(lib, [folder]).start()
+            scan.thread.join()
+            record(f"library scan {name}", (time.perf_counter() - start) * 1000, Tracks=size)
+        lib.close()
+        shutil.rmtree(folder)
+
+# Search over made up records, so big libraries don't need files on disk
+def benchSearch(searchModule, sizes):
+    syllables = ["la", "mo", "ri", "ka", "ten", "so", "vel", "dar", "in", "ex", "on", "bre", "quo", "zu", "pha", "nor"]
+    def word(i, salt):
+        return "".join(syllables[(i * 7 + salt * 13 + n * 5) % len(syllables)] for n in range(1 + (i + salt) % 3))
+
+    for size in sizes:
+        tracks = [{
+            "Path": f"/music/{word(i, 1)} {word(i, 2)} {i}.mp3", "MTime": 0, "Size": i,
+            "Title": f"{word(i, 3)} {word(i // 3, 4)} {word(i // 7, 5)}",
+            "Artist": f"{word(i // 11, 6)} {word(i // 13, 7)}", "Album": word(i // 17, 8)
+        } for i in range(size)]
+
+        index = searchModule.searchIndex()
+        start = time.perf_counter()
+        index.sync(tracks)
+        record("search index build", (time.perf_counter() - start) * 1000, Tracks=size)
+
+        tracks[0] = dict(tracks[0], Title="Changed", MTime=1)
+        start = time.perf_counter()
+        index.sync(tracks)
+        record("search index resync", (time.perf_counter() - start) * 1000, Tracks=size)
+
+        # Type a query one key at a time, as the search box would
+        def typing():
+            index.last = ([], None)
+            for end in range(1, len("ten sola") + 1):
+                index.search("ten sola"[:end])
+        result = bench("search typing per key", typing, 10, Tracks=size)
+        result["MeanMs"] /= 8
+        result["MinMs"] /= 8
+        result["P95Ms"] /= 8
+
+# Memory and lookup cost of the playlist, against a plain list of paths and a dict to find them
+def benchPlaylist(pathTableModule, sizes):
+    for size in sizes:
+        # Made as they're needed, so the list version is charged for its strings
+        def paths():
+            return (f"/home/user/Music/Artist {i // 200:04d}/Album {i // 12:05d}/{i % 12:02d} Some Track Title {i}.mp3" for i in range(size))
+
+        def buildList():
+            playlist = list(paths())
+            return playlist, {path: ID for ID, path in enumerate(playlist)}
+
+        for name, build in (("list", buildList), ("pathTable", lambda: pathTableModule.pathTable(paths()))):
+            start = time.perf_counter()
+            table = build()
+            ms = (time.perf_counter() - start) * 1000
+            del table
+            # Measured on a second build, since tracing slows everything down
+            tracemalloc.start()
+            table = build()
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            record(f"playlist build {name}", ms, Tracks=size, Bytes=used)
+            del table
+
+        table = pathTableModule.pathTable(paths())
+        probes = list(paths())[::max(1, size // 1000)]
+        result = bench("playlist find", lambda: [table.find(path) for path in probes], 10, Tracks=size)
+        result["MeanMs"] /= len(probes)
+        result["MinMs"] /= len(probes)
+        result["P95Ms"] /= len(probes)
+
+# Working out a waveform from scratch against reading it back from the cache
+def benchWaveform(waveformModule, workDir, tracks):
+    cache = waveformModule.waveformCache(os.path.join(workDir, "waveforms"))
+    for path in tracks:
+        stat = os.stat(path)
+        start = time.perf_counter()
+        levels = cache.compute(path)
+        record("waveform compute", (time.perf_counter() - start) * 1000, Track=os.path.basename(path))
+        cache.save(path, stat.st_mtime, stat.st_size, *levels)
+        bench("waveform cached load", lambda: cache.load(path, stat.st_mtime, stat.st_size), 50, Track=os.path.basename(path))
+
+# Measuring a track's loudness, which only happens once per track
+def benchLoudness(loudnessModule, tracks):
+    for path in tracks:
+        start = time.perf_counter()
+        loudnessModule.measureGain(path)
+        record("loudness measure", (time.perf_counter() - start) * 1000, Track=os.path.basename(path))
+
+# Recording plays, which the UI thread does on every track change, then writing and reading them back
+def benchHistory(historyModule, lib, workDir, tracks=5000):
+    logPath = os.path.join(workDir, "history.log")
+    snapshotPath = os.path.join(workDir, "history.bin")
+    history = historyModule.playHistory(lib, logPath, snapshotPath)
+    counter = [0]
+    def play():
+        counter[0] += 1
+        history.begin(counter[0] % tracks + 1)
+        history.end(skipped=counter[0] % 4 == 0)
+    bench("history begin+end", play, 20000)
+
+    start = time.perf_counter()
+    history.close()
+    record("history write", (time.perf_counter() - start) * 1000, Plays=counter[0])
+
+    start = time.perf_counter()
+    historyModule.playHistory(lib, logPath, snapshotPath).close()
+    record("history load", (time.perf_counter() - start) * 1000, Plays=counter[0], Tracks=tracks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Music Player benchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Library sizes to scan, comma separated")
+    parser.add_argument("--out", help="Write the JSON results here instead of stdout")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    workDir = tempfile.mkdtemp(prefix="musicplayer-bench-")
+    try:
+        # main.py loads icons and data relative to the working directory
+        shutil.copytree(os.path.join(ROOT, "Icons"), os.path.join(workDir, "Icons"))
+        os.makedirs(os.path.join(workDir, "Data"))
+        shutil.copy(os.path.join(ROOT, "Data", "defaults.json"), os.path.join(workDir, "Data", "cfg.json"))
+        musicDir = os.path.join(workDir, "music")
+        os.makedirs(musicDir)
+        tracks = []
+        for i in range(4):
+            tracks.append(os.path.join(musicDir, f"silent{i}.mp3"))
+            writeSilentMP3(tracks[-1], 30)
+            tracks.append(os.path.join(musicDir, f"silent{i}.wav"))
+            writeSilentWAV(tracks[-1], 5)
+
+        os.chdir(workDir)
+        import main as player
+        import ioMethods as io
+        import library
+        import search
+        import pathTable
+        import waveform
+        import loudness
+        import playHistory
+
+        # The player prints as it goes, so keep stdout clean for the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            benchStartup(player)
+            benchWidgets(io, player.sc)
+            benchPlayer(player, tracks)
+            benchScans(library, workDir, sizes)
+            benchSearch(search, sizes)
+            benchPlaylist(pathTable, sizes)
+            benchWaveform(waveform, workDir, tracks[:2])
+            benchLoudness(loudness, tracks[:2])
+            benchHistory(playHistory, player.lib, workDir)
+
+        player.lib.close()
+        pg.quit()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    report = {
+        "Python": platform.python_version(),
+        "Pygame": pg.version.ver,
+        "Platform": platform.platform(),
+        "Results": results
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
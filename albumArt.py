@@ -0,0 +1,160 @@
+# Cover art for the player screen. A worker thread pulls the embedded picture out
+# of a track's tags, scales it down once and saves it as a thumbnail named by a hash
+# of the picture, so every track of an album shares one. The library remembers
+# which thumbnail each track uses, so tags are only read the first time a track
+# is shown. Thumbnails on disk and converted surfaces in memory are both capped.
+import io
+import os
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+import pygame as pg
+
+ART_READY = pg.USEREVENT + 5
+
+ART_DIR = os.path.join("Data", "art")
+
+# Biggest a thumbnail can be, in pixels
+THUMB_SIZE = (160, 160)
+
+# Most the thumbnails on disk can add up to, and how many surfaces to keep in memory
+MAX_DISK_BYTES = 16 * 1024 * 1024
+MAX_SURFACES = 32
+
+# The picture to show from a tag: the front cover if there is one, otherwise the first
+def pickImage(tag):
+    images = list(tag.images) if tag else []
+    for image in images:
+        if image.picture_type == image.FRONT_COVER and image.image_data:
+            return image
+    return next((image for image in images if image.image_data), None)
+
+# Scale a picture down to fit in "size", keeping its shape
+def fitImage(image, size=THUMB_SIZE):
+    scale = min(size[0] / image.get_width(), size[1] / image.get_height(), 1)
+    if scale == 1:
+        return image
+    return pg.transform.smoothscale(image, (max(1, round(image.get_width() * scale)), max(1, round(image.get_height() * scale))))
+
+class artCache:
+    def __init__(self, lib, folder=ART_DIR, maxBytes=MAX_DISK_BYTES, maxSurfaces=MAX_SURFACES):
+        self.lib = lib
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.maxSurfaces = maxSurfaces
+        # Thumbnail name -> converted surface, least recently used first. Only used on the UI thread.
+        self.surfaces = OrderedDict()
+        self.requests = queue.Queue()
+        self.latest = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def thumbPath(self, name):
+        return os.path.join(self.folder, name + ".png")
+
+    # A thumbnail already in memory, or None. "name" is a track record's "Art".
+    def cached(self, name):
+        surface = self.surfaces.get(name) if name else None
+        if surface is not None:
+            self.surfaces.move_to_end(name)
+        return surface
+
+    # Convert a surface from the worker and keep it, dropping the least recently used
+    def keep(self, name, surface):
+        if name in self.surfaces:
+            return self.cached(name)
+        if pg.display.get_surface():
+            surface = surface.convert_alpha()
+        self.surfaces[name] = surface
+        if len(self.surfaces) > self.maxSurfaces:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    # Ask for a track's art. An ART_READY event follows, with "surface" None if it has none.
+    def request(self, path):
+        self.latest = path
+        self.requests.put(path)
+
+    # Pull the picture out of a file's tags and save its thumbnail. Returns the
+    # thumbnail's name, or "" if the file has no picture.
+    def extract(self, path):
+        import eyed3
+        try:
+            song = eyed3.load(path)
+        except Exception as e:
+            print(f"Couldn't read tags for {path}: {e}")
+            song = None
+        image = pickImage(song.tag if song else None)
+        if image is None:
+            return ""
+
+        name = hashlib.sha1(image.image_data).hexdigest()
+        if not os.path.exists(self.thumbPath(name)):
+            # The mime type makes a good enough hint, e.g. "image/jpeg" -> "jpeg"
+            hint = (image.mime_type or "").rpartition("/")[2] or "jpg"
+            try:
+                thumb = fitImage(pg.image.load(io.BytesIO(image.image_data), "art." + hint))
+            except pg.error as e:
+                print(f"Couldn't read the cover art of {path}: {e}")
+                return ""
+            self.save(name, thumb)
+        return name
+
+    def save(self, name, thumb):
+        os.makedirs(self.folder, exist_ok=True)
+        tmpPath = self.thumbPath(name) + ".tmp.png"
+        pg.image.save(thumb, tmpPath)
+        os.replace(tmpPath, self.thumbPath(name))
+        self.trim()
+
+    # Delete the least recently used thumbnails until they fit in the budget.
+    # Tracks whose thumbnail went just have their tags read again next time.
+    def trim(self):
+        thumbs = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".png") and not entry.name.endswith(".tmp.png"):
+                    stat = entry.stat()
+                    thumbs.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in thumbs)
+        for _, size, path in sorted(thumbs):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # Load a saved thumbnail, or None if it has been trimmed away
+    def load(self, name):
+        path = self.thumbPath(name)
+        try:
+            surface = pg.image.load(path)
+            # Mark it as recently used so trim() keeps it
+            os.utime(path)
+        except (OSError, pg.error):
+            return None
+        return surface
+
+    def run(self):
+        while True:
+            path = self.requests.get()
+            if path != self.latest:
+                continue
+
+            try:
+                track = self.lib.get(path)
+                name = track["Art"] if track else ""
+                surface = None
+                if name is None or (name and name not in self.surfaces and not os.path.exists(self.thumbPath(name))):
+                    name = self.extract(path)
+                    self.lib.setArt(path, name)
+                if name and name not in self.surfaces:
+                    surface = self.load(name)
+            except OSError as e:
+                print(f"Couldn't get the cover art of {path}: {e}")
+                name, surface = "", None
+
+            pg.event.post(pg.event.Event(ART_READY, path=path, name=name, surface=surface))
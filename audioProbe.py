@@ -0,0 +1,275 @@
+# Cheap track length probing. Reads file headers instead of decoding audio.
+import os
+import struct
+import wave
+
+# MPEG audio lookup tables, indexed by [version][layer] / [version]
+# Versions: 0 = MPEG 2.5, 2 = MPEG 2, 3 = MPEG 1 (1 is reserved)
+# Layers: 1 = Layer III, 2 = Layer II, 3 = Layer I (0 is reserved)
+BITRATES = {
+    (3, 3): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (3, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (3, 1): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 3): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 1): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+# How much of the file to search for the first audio frame
+SCAN_BYTES = 64 * 1024
+# How far into an untagged file isAudio looks for an MPEG frame
+SNIFF_BYTES = 4 * 1024
+
+# Parse a 4 byte MPEG frame header. Returns a dict or None if it isn't valid.
+def parseFrameHeader(data, offset=0):
+    if len(data) < offset + 4:
+        return None
+    b1, b2, b3, b4 = data[offset:offset + 4]
+    if b1 != 0xFF or (b2 & 0xE0) != 0xE0:
+        return None
+
+    version = (b2 >> 3) & 0x03
+    layer = (b2 >> 1) & 0x03
+    bitrateIndex = (b3 >> 4) & 0x0F
+    rateIndex = (b3 >> 2) & 0x03
+    if version == 1 or layer == 0 or bitrateIndex in (0, 15) or rateIndex == 3:
+        return None
+
+    bitrate = BITRATES[(3 if version == 3 else 2, layer)][bitrateIndex] * 1000
+    sampleRate = SAMPLE_RATES[version][rateIndex]
+    padding = (b3 >> 1) & 0x01
+    mono = ((b4 >> 6) & 0x03) == 3
+
+    if layer == 3:
+        samples = 384
+        length = (12 * bitrate // sampleRate + padding) * 4
+    elif layer == 2 or version == 3:
+        samples = 1152
+        length = 144 * bitrate // sampleRate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sampleRate + padding
+
+    return {
+        "Version": version,
+        "Layer": layer,
+        "Bitrate": bitrate,
+        "SampleRate": sampleRate,
+        "Mono": mono,
+        "Samples": samples,
+        "Length": length
+    }
+
+# Decode a 4 byte ID3v2 "syncsafe" integer
+def syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+# Read the ID3v2 header at the start of a file. Returns (tagSize, TLEN in ms or None).
+def readID3v2(f):
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0, None
+
+    major = header[3]
+    flags = header[5]
+    size = syncsafe(header[6:10])
+    total = size + 10 + (10 if flags & 0x10 else 0)
+
+    # Only look for TLEN in the tag formats we know how to walk
+    tlen = None
+    if major in (3, 4) and not flags & 0x80:
+        body = f.read(size)
+        pos = 0
+        while pos + 10 <= len(body):
+            frameID = body[pos:pos + 4]
+            if frameID[0] == 0:
+                break
+            if major == 4:
+                frameSize = syncsafe(body[pos + 4:pos + 8])
+            else:
+                frameSize = struct.unpack(">I", body[pos + 4:pos + 8])[0]
+            if frameID == b"TLEN":
+                raw = body[pos + 11:pos + 10 + frameSize]
+                try:
+                    tlen = int(raw.decode("latin-1").strip("\x00 ")) or None
+                except ValueError:
+                    tlen = None
+                break
+            pos += 10 + frameSize
+    return total, tlen
+
+# Find the first frame header that is followed by another valid frame
+def findFirstFrame(data):
+    pos = data.find(b"\xFF")
+    while 0 <= pos < len(data) - 4:
+        header = parseFrameHeader(data, pos)
+        if header:
+            nextPos = pos + header["Length"]
+            if nextPos + 4 > len(data) or parseFrameHeader(data, nextPos):
+                return pos, header
+        pos = data.find(b"\xFF", pos + 1)
+    return -1, None
+
+# Read the frame count out of a Xing/Info or VBRI header, if the first frame has one
+def readVBRFrames(frame, header):
+    if header["Version"] == 3:
+        sideInfo = 17 if header["Mono"] else 32
+    else:
+        sideInfo = 9 if header["Mono"] else 17
+
+    xing = 4 + sideInfo
+    if frame[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", frame[xing + 4:xing + 8])[0]
+        if flags & 0x01:
+            return struct.unpack(">I", frame[xing + 8:xing + 12])[0]
+
+    if frame[36:40] == b"VBRI":
+        return struct.unpack(">I", frame[50:54])[0]
+    return None
+
+# Work out an MP3's length from its headers. Returns seconds or None.
+def probeMP3(path):
+    fileSize = os.path.getsize(path)
+    with open(path, "rb") as f:
+        tagSize, tlen = readID3v2(f)
+        f.seek(tagSize)
+        data = f.read(SCAN_BYTES)
+
+        # ID3v1 tags sit in the last 128 bytes and aren't audio
+        f.seek(max(0, fileSize - 128))
+        tail = f.read(3)
+
+    offset, header = findFirstFrame(data)
+    if not header:
+        return tlen / 1000 if tlen else None
+
+    # 1. Xing/Info/VBRI frame counts are exact
+    frames = readVBRFrames(data[offset:offset + header["Length"]], header)
+    if frames:
+        return frames * header["Samples"] / header["SampleRate"]
+
+    # 2. The tag's own idea of the length
+    if tlen:
+        return tlen / 1000
+
+    # 3. Assume constant bitrate
+    audioBytes = fileSize - tagSize - offset - (128 if tail == b"TAG" else 0)
+    return audioBytes * 8 / header["Bitrate"]
+
+# Read a WAV's length from its header
+def probeWAV(path):
+    with wave.open(path, "rb") as w:
+        return w.getnframes() / w.getframerate()
+
+# Sample rate and total samples from a FLAC STREAMINFO block, or None if it doesn't say
+def streamInfoLength(info):
+    packed = int.from_bytes(info[10:18], "big")
+    sampleRate = packed >> 44
+    totalSamples = packed & ((1 << 36) - 1)
+    return totalSamples / sampleRate if sampleRate and totalSamples else None
+
+# Read a FLAC's length from its STREAMINFO block, which always comes first
+def probeFLAC(path):
+    with open(path, "rb") as f:
+        # Some taggers put an ID3 tag in front
+        tagSize, _ = readID3v2(f)
+        f.seek(tagSize)
+        if f.read(4) != b"fLaC":
+            return None
+        header = f.read(4)
+        if len(header) < 4 or header[0] & 0x7F != 0:
+            return None
+        return streamInfoLength(f.read(34))
+
+# How much of the end of an Ogg file to search for its last page
+OGG_TAIL_BYTES = 64 * 1024
+
+# Read an Ogg Vorbis, Opus or FLAC file's length. The first packet gives the rate
+# and the last page's granule position the number of samples.
+def probeOgg(path):
+    fileSize = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(27)
+        if len(head) < 27 or head[:4] != b"OggS":
+            return None
+        segments = f.read(head[26])
+        packet = f.read(sum(segments))
+        f.seek(max(0, fileSize - OGG_TAIL_BYTES))
+        tail = f.read()
+
+    preSkip = 0
+    if packet[:7] == b"\x01vorbis":
+        rate = struct.unpack_from("<I", packet, 12)[0]
+    elif packet[:8] == b"OpusHead":
+        # Opus granules always count at 48kHz, after the decoder's start up samples
+        preSkip = struct.unpack_from("<H", packet, 10)[0]
+        rate = 48000
+    elif packet[:5] == b"\x7fFLAC":
+        return streamInfoLength(packet[17:51])
+    else:
+        return None
+
+    # The last page that says where it ends. Granule -1 means no packet ends on that page.
+    serial = head[14:18]
+    page = tail.rfind(b"OggS")
+    while page != -1:
+        if len(tail) >= page + 27 and tail[page + 14:page + 18] == serial:
+            granule = struct.unpack_from("<q", tail, page + 6)[0]
+            if granule >= 0:
+                return (granule - preSkip) / rate if rate and granule > preSkip else None
+        page = tail.rfind(b"OggS", 0, page)
+    return None
+
+# Get the length of a track in seconds, trying the cheap readers first.
+# Only falls back to decoding the whole file if "allowDecode" is set.
+def probeDuration(path, allowDecode=True):
+    ext = os.path.splitext(path)[1].lower()
+    readers = {".mp3": probeMP3, ".wav": probeWAV, ".flac": probeFLAC, ".ogg": probeOgg, ".oga": probeOgg, ".opus": probeOgg}
+
+    if ext in readers:
+        try:
+            length = readers[ext](path)
+            if length:
+                return length
+        except (OSError, EOFError, struct.error, wave.Error) as e:
+            print(f"Couldn't probe {path}: {e}")
+
+    if allowDecode:
+        import pygame as pg
+        return pg.mixer.Sound(path).get_length()
+    return 0
+
+# Audio formats the mixer can play, by extension
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".ogg", ".oga", ".opus", ".flac"}
+
+# Check a file's first bytes really are audio, so a stray file with an audio
+# extension never makes it into the playlist
+def isAudio(path):
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+            if head[:3] == b"ID3":
+                # Skip the tag and look for the first frame
+                f.seek(0)
+                tagSize, _ = readID3v2(f)
+                f.seek(tagSize)
+                return findFirstFrame(f.read(SCAN_BYTES))[1] is not None
+
+            if head[:4] in (b"OggS", b"fLaC"):
+                return True
+            if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+                return True
+            if parseFrameHeader(head):
+                return True
+            # MP3s without a tag can start with padding or junk, so look a little way in for
+            # the first frame. Random bytes can look like one, so it has to be followed by another.
+            data = head + f.read(SNIFF_BYTES - len(head))
+            offset, header = findFirstFrame(data)
+            return header is not None and parseFrameHeader(data, offset + header["Length"]) is not None
+    except (OSError, struct.error):
+        return False
@@ -1,7 +1,8 @@
-# Initialize Pygame
+# Initialize Pygame's fonts. The rest is up to the program, so importing this doesn't start everything.
+import time
 import pygame as pg
-import textwrap
-pg.init()
+from collections import OrderedDict
+pg.font.init()
 
 # Define a font and color palette using a class
 FONT = pg.font.Font(None, 24)
@@ -13,6 +14,27 @@ class colours:
     TEXT_COLOUR = (0, 0, 0)
     PROMPT_COLOUR = (30, 30, 30)
 
+# ---------- ASSETS ---------- #
+# Images shared between widgets, loaded, scaled and converted once
+images = {}
+
+def loadImage(path, scale=1):
+    key = (path, scale)
+    if key not in images:
+        image = pg.image.load(path)
+        if scale != 1:
+            image = pg.transform.scale(image, (int(image.get_width() * scale), int(image.get_height() * scale)))
+        # Converting needs a display, so images loaded before one exists stay as they are
+        if pg.display.get_surface():
+            image = image.convert_alpha()
+        images[key] = image
+    return images[key]
+
+# Load a batch of images up front so nothing touches the disk later
+def preloadImages(paths, scale=1):
+    for path in paths:
+        loadImage(path, scale)
+
 # Define an input box class for text input
 class inputBox:
     def __init__(self, x, y, w=140, h=32, max = 0, prompt="", filled=False, text=""):
@@ -27,9 +49,22 @@ class inputBox:
         self.hover = False
         self.filled = filled
         self.finalText = "placeholder"
+        self.dirty = True
+        # Lets the event dispatcher send it key presses once clicked
+        self.takesFocus = True
+
+    # Empty the box, ready to be typed into straight away if "active" is set
+    def clear(self, active=False):
+        self.text = ""
+        self.textSurface = FONT.render("", True, colours.TEXT_COLOUR)
+        self.active = active
+        self.colour = colours.COLOUR_ACTIVE if active else colours.COLOUR_INACTIVE
+        self.dirty = True
 
     # Handle events such as mouse clicks and key presses
     def handleEvent(self, event):
+        if event.type in (pg.MOUSEBUTTONDOWN, pg.KEYDOWN, pg.MOUSEMOTION):
+            self.dirty = True
         # Mouse events
         if event.type == pg.MOUSEBUTTONDOWN:
             # Check if mouse clicked inside the input box
@@ -90,10 +125,11 @@ class inputBox:
         else:
             screen.blit(self.textSurface, (self.rect.x + 5, self.rect.y + 8))
             pg.draw.rect(screen, self.colour, self.rect, 2)
+        return self.rect.copy()
 
-# Define a class for an input slider
+# Define a class for an input slider. "action" is called with the new value whenever it moves.
 class inputSlider:
-    def __init__(self, x, y, length=200, height=10, min_value=0, max_value=100, default_value=100):
+    def __init__(self, x, y, length=200, height=10, min_value=0, max_value=100, default_value=100, action=None):
         # Initialize input slider attributes
         self.rect = pg.Rect(x, y, length, height)
         self.colour = colours.COLOUR_INACTIVE
@@ -102,32 +138,52 @@ class inputSlider:
         self.max_value = max_value
         self.knob_radius = height
         self.held = False
+        self.action = action
+        self.dirty = True
+
+    # Move the knob to under the mouse
+    def slideTo(self, mouse_x):
+        mouse_x = max(self.rect.x, min(mouse_x, self.rect.x + self.rect.width))
+        percent = (mouse_x - self.rect.x) / self.rect.width
+        value = int(self.min_value + percent * (self.max_value - self.min_value))
+        if value != self.value:
+            self.value = value
+            self.dirty = True
+            if self.action:
+                self.action(value)
 
     # Handle mouse events for the input slider
     def handleEvent(self, event):
-        # Mouse button down event
-        if event.type == pg.MOUSEBUTTONDOWN:
+        # Left mouse button down event. The wheel sends buttons 4 and 5, which shouldn't move it.
+        if event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
             # Check if mouse clicked inside the slider
             if self.rect.collidepoint(event.pos):
                 self.held = True
                 self.colour = colours.COLOUR_ACTIVE
+                self.slideTo(event.pos[0])
             else:
                 self.held = False
                 self.colour = colours.COLOUR_INACTIVE
+            self.dirty = True
 
         # Mouse motion event
         if event.type == pg.MOUSEMOTION:
             # If slider is being held, update the value based on mouse position
             if self.held:
-                mouse_x, _ = event.pos
-                mouse_x = max(self.rect.x, min(mouse_x, self.rect.x + self.rect.width))
-                percent = (mouse_x - self.rect.x) / self.rect.width
-                self.value = int(self.min_value + percent * (self.max_value - self.min_value))
+                self.slideTo(event.pos[0])
 
-        # Mouse button up event
-        if event.type == pg.MOUSEBUTTONUP:
+        # Left mouse button up event
+        if event.type == pg.MOUSEBUTTONUP and event.button == 1:
             self.held = False
             self.colour = colours.COLOUR_INACTIVE
+            self.dirty = True
+
+    # Set the value from outside, e.g. with the keyboard
+    def setValue(self, value):
+        value = max(self.min_value, min(value, self.max_value))
+        if value != self.value:
+            self.value = value
+            self.dirty = True
 
     # Draw the input slider on the screen
     def draw(self, screen):
@@ -137,44 +193,47 @@ class inputSlider:
         knob_x = int(self.rect.x + (self.value - self.min_value) / (self.max_value - self.min_value) * self.rect.width)
         knob_rect = pg.Rect(knob_x - self.knob_radius, self.rect.y - self.knob_radius / 2, 2 * self.knob_radius, 2 * self.knob_radius)
         pg.draw.circle(screen, self.colour, knob_rect.center, self.knob_radius)
+        # The knob hangs over the ends and edges of the bar
+        return self.rect.inflate(2 * self.knob_radius + 2, 2 * self.knob_radius)
 
     # String representation of the input slider for debugging
     def __str__(self):
         return f"An input slider. Length = {self.rect.width}, height = {self.rect.height}. @({self.rect.x},{self.rect.y})"
 
 
-# Define a class for a button with an image
+# Define a class for a button with an image. Clicks arrive as events, so it
+# fires once per click however long the mouse is held down.
 class button:
-    def __init__(self, x, y, texturePath, action, delay=500):
-        # Initialize button attributes
-        original_image = pg.image.load(texturePath)
-        width, height = original_image.get_width(), original_image.get_height()
-
-        # Scale the image based on the provided scale factor
-        scaled_width = int(width * 5)
-        scaled_height = int(height * 5)
-        self.image = pg.transform.scale(original_image, (scaled_width, scaled_height))
+    def __init__(self, x, y, texturePath, action, scale=5):
+        # Initialize button attributes, sharing the scaled image with any other users of it
+        self.image = loadImage(texturePath, scale)
 
         self.rect = self.image.get_rect(topleft=(x, y))
         self.action = action
-        self.delay = delay
-        self.last_press_time = 0
+        self.pressed = False
+        self.dirty = True
 
-    def handleEvent(self):
-        # Mouse events
-        mouse_pos = pg.mouse.get_pos()
-        if pg.mouse.get_pressed()[0]:  # Check if left mouse button is pressed
-            # Check if the mouse clicked inside the button and if enough time has passed
-            current_time = pg.time.get_ticks()
-            if current_time - self.last_press_time > self.delay and self.rect.collidepoint(mouse_pos):
+    # Swap the button's image, only redrawing it if it actually changed
+    def setImage(self, image):
+        if image is not self.image:
+            self.image = image
+            self.dirty = True
+
+    def handleEvent(self, event):
+        # A click is a left press and release that both land on the button
+        if event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
+            self.pressed = self.rect.collidepoint(event.pos)
+        elif event.type == pg.MOUSEBUTTONUP and event.button == 1:
+            if self.pressed and self.rect.collidepoint(event.pos):
                 # Call the action function without arguments
                 self.action()
-                self.last_press_time = current_time  # Update the last press time
+            self.pressed = False
 
     def draw(self, sc):
-        sc.blit(self.image, self.rect)
+        return sc.blit(self.image, self.rect)
 
     def centre(self, screen, xPos=-1, yPos=-1):
+        oldPos = self.rect.topleft
         if xPos != -1:
             self.rect.x = xPos - self.rect.width // 2
         elif yPos != -1:
@@ -182,8 +241,39 @@ class button:
         else:
             self.rect.x = (screen.get_width() - self.rect.width) // 2
             self.rect.y = (screen.get_height() - self.rect.height) // 2
+        if self.rect.topleft != oldPos:
+            self.dirty = True
 
 # ---------- OUTPUT ---------- #
+# Fonts shared between widgets, by size
+fonts = {}
+
+def getFont(size):
+    if size not in fonts:
+        fonts[size] = pg.font.Font(None, size)
+    return fonts[size]
+
+# Least recently used cache of rendered text, shared by every text widget so
+# strings like timestamps that come round again are only rendered once
+class surfaceCache:
+    def __init__(self, maxSize=512):
+        self.maxSize = maxSize
+        self.surfaces = OrderedDict()
+
+    def render(self, fontSize, line, colour):
+        key = (fontSize, line, colour)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = getFont(fontSize).render(line, True, colour)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.maxSize:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+TEXT_CACHE = surfaceCache()
+
 class text:
     def __init__(self, x, y, text="", scale=1, colourOverride = colours.TEXT_COLOUR):
         self.x = x
@@ -192,45 +282,72 @@ class text:
         self.colour = colourOverride
         self.fontSize = 24 * scale
 
-        self.font = pg.font.Font(None, self.fontSize)
+        self.font = getFont(self.fontSize)
+
+        # Wrapped and rendered lines, rebuilt only when "layoutKey" changes
+        self.layoutKey = None
+        self.lines = []
 
-        self.textSurface = self.font.render(str(self.text), True, self.colour)
+        self.updateSurface()
+        self.dirty = True
 
+    # Single line render of the text, used for measuring and centring
     def updateSurface(self):
-        try:
-            wrappedText = textwrap.fill(self.text, width=20)
-            self.textSurface = self.font.render(wrappedText, True, self.colour)
-        except Exception as e:
-            print(e)
+        self.textSurface = TEXT_CACHE.render(self.fontSize, str(self.text), self.colour)
+
+    # Wrap and render the text for a given width, reusing the last layout if nothing changed
+    def layout(self, maxWidth):
+        key = (self.text, self.colour, maxWidth)
+        if key != self.layoutKey:
+            self.lines = [
+                TEXT_CACHE.render(self.fontSize, line, self.colour)
+                for line in self.wrapTextToFit(str(self.text), self.font, maxWidth)
+            ]
+            self.layoutKey = key
+        return self.lines
 
     def setText(self, text):
-        self.text = text
-        self.updateSurface()
+        if text != self.text:
+            self.text = text
+            self.updateSurface()
+            self.dirty = True
 
     def setColour(self, colour):
-        self.colour = colour
-        self.updateSurface()
+        if colour != self.colour:
+            self.colour = colour
+            self.updateSurface()
+            self.dirty = True
+
+    # Move the text, only redrawing it if it actually moved
+    def setPos(self, x=None, y=None):
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        if (x, y) != (self.x, self.y):
+            self.x, self.y = x, y
+            self.dirty = True
 
     def handleEvent(self, event):
         # Text output doesn't handle any events
         pass
 
     def draw(self, screen):
-        lines = self.wrapTextToFit(self.text, self.font, screen.get_width())
+        drawnRect = pg.Rect(self.x, self.y, 0, 0)
 
-        for i, line in enumerate(lines):
-            text_surface = self.font.render(line, True, self.colour)
+        for i, text_surface in enumerate(self.layout(screen.get_width())):
             y_offset = i * self.font.get_linesize()
-            screen.blit(text_surface, (self.x, self.y + y_offset))
+            drawnRect.union_ip(screen.blit(text_surface, (self.x, self.y + y_offset)))
+        return drawnRect
 
     def centre(self, screen, xPos=-1, yPos=-1):
         if xPos != -1:
-            self.x = xPos
+            self.setPos(x=xPos)
         elif yPos != -1:
-            self.y = yPos
+            self.setPos(y=yPos)
         else:
-            self.x = (screen.get_width() - self.textSurface.get_width()) // 2
-            self.y = (screen.get_height() - self.textSurface.get_height()) // 2
+            self.setPos(
+                (screen.get_width() - self.textSurface.get_width()) // 2,
+                (screen.get_height() - self.textSurface.get_height()) // 2
+            )
 
     @staticmethod
     def wrapTextToFit(text, font, max_width):
@@ -254,34 +371,408 @@ class text:
     def __str__(self):
         return f"A text output. Text: {self.text}. Font size: {self.font_size}. @({self.x},{self.y})"
 
+# Scrolling list of tracks that only ever renders the rows in view, so a
+# 50k track playlist costs the same to draw as a 10 track one.
+# "labelFor" turns a row index into its text and "action" is called with the clicked index.
+class trackList:
+    def __init__(self, x, y, w, h, count=0, labelFor=str, action=None, rowHeight=22, fontSize=20,
+                 colour=colours.TEXT_COLOUR, background=(235, 225, 245), highlight=colours.COLOUR_HOVER):
+        self.rect = pg.Rect(x, y, w, h)
+        self.count = count
+        self.labelFor = labelFor
+        self.action = action
+        self.rowHeight = rowHeight
+        self.fontSize = fontSize
+        self.colour = colour
+        self.background = background
+        self.highlight = highlight
+
+        # Scroll position in pixels, eased towards "target" for smooth scrolling
+        self.offset = 0.0
+        self.target = 0.0
+        self.selected = None
+        self.pressedRow = None
+
+        # Rendered rows by index. Only rows near the view are kept.
+        self.rows = {}
+        self.dirty = True
+
+    def visibleRows(self):
+        return self.rect.height // self.rowHeight + 2
+
+    def maxOffset(self):
+        return max(0, self.count * self.rowHeight - self.rect.height)
+
+    # Swap in a new list of items (e.g. after a rescan)
+    def setCount(self, count):
+        self.count = count
+        self.rows.clear()
+        self.scrollTo(self.target)
+        self.dirty = True
+
+    def setSelected(self, index):
+        if index != self.selected:
+            self.selected = index
+            self.dirty = True
+
+    def scrollTo(self, offset):
+        self.target = max(0, min(offset, self.maxOffset()))
+
+    # Scroll so a row sits in the middle of the list
+    def jumpTo(self, index, smooth=True):
+        self.scrollTo(index * self.rowHeight - (self.rect.height - self.rowHeight) // 2)
+        if not smooth:
+            self.offset = self.target
+            self.dirty = True
+
+    # Move the scroll position towards its target. Call once a frame.
+    def update(self):
+        if self.offset != self.target:
+            self.offset += (self.target - self.offset) * 0.35
+            if abs(self.target - self.offset) < 0.5:
+                self.offset = self.target
+            self.dirty = True
+
+    def rowAt(self, pos):
+        index = int((pos[1] - self.rect.y + self.offset) // self.rowHeight)
+        return index if 0 <= index < self.count else None
+
+    def handleEvent(self, event):
+        if event.type == pg.MOUSEWHEEL:
+            self.scrollTo(self.target - event.y * self.rowHeight * 3)
+        elif event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
+            self.pressedRow = self.rowAt(event.pos) if self.rect.collidepoint(event.pos) else None
+        elif event.type == pg.MOUSEBUTTONUP and event.button == 1:
+            # Only count it as a click if the press and release are on the same row
+            if self.rect.collidepoint(event.pos) and self.pressedRow is not None and self.rowAt(event.pos) == self.pressedRow:
+                self.setSelected(self.pressedRow)
+                if self.action:
+                    self.action(self.pressedRow)
+            self.pressedRow = None
+        elif event.type == pg.KEYDOWN:
+            if event.key == pg.K_PAGEDOWN:
+                self.scrollTo(self.target + self.rect.height)
+            elif event.key == pg.K_PAGEUP:
+                self.scrollTo(self.target - self.rect.height)
+
+    def renderRow(self, index):
+        row = self.rows.get(index)
+        if row is None:
+            row = getFont(self.fontSize).render(str(self.labelFor(index)), True, self.colour)
+            self.rows[index] = row
+        return row
+
+    def draw(self, screen):
+        first = int(self.offset // self.rowHeight)
+        last = min(self.count, first + self.visibleRows())
+
+        # Drop rendered rows that have scrolled well out of view
+        keep = range(first - self.visibleRows(), last + self.visibleRows())
+        for index in [index for index in self.rows if index not in keep]:
+            del self.rows[index]
+
+        oldClip = screen.get_clip()
+        screen.set_clip(self.rect)
+        pg.draw.rect(screen, self.background, self.rect)
+        for index in range(first, last):
+            y = self.rect.y + index * self.rowHeight - int(self.offset)
+            if index == self.selected:
+                pg.draw.rect(screen, self.highlight, (self.rect.x, y, self.rect.width, self.rowHeight))
+            row = self.renderRow(index)
+            screen.blit(row, (self.rect.x + 4, y + (self.rowHeight - row.get_height()) // 2))
+        screen.set_clip(oldClip)
+
+        pg.draw.rect(screen, colours.COLOUR_ACTIVE, self.rect, 2)
+        return self.rect
+
+    def __str__(self):
+        return f"A track list. {self.count} rows. @({self.rect.x},{self.rect.y})"
+
+# Define a class for a picture that can be swapped out, e.g. cover art. It's drawn
+# centred in its rect, and None shows nothing.
+class picture:
+    def __init__(self, x, y, width, height, image=None):
+        self.rect = pg.Rect(x, y, width, height)
+        self.image = image
+        self.dirty = True
+
+    def setImage(self, image):
+        if image is not self.image:
+            self.image = image
+            self.dirty = True
+
+    def handleEvent(self, event):
+        # No events
+        pass
+
+    def draw(self, screen):
+        if self.image:
+            screen.blit(self.image, self.image.get_rect(center=self.rect.center))
+        # The whole rect, so a smaller picture replacing a bigger one clears it properly
+        return self.rect
+
+    def __str__(self):
+        return f"A picture. Width = {self.rect.width}, height = {self.rect.height}. @({self.rect.x},{self.rect.y})"
+
+# Define a class for a progress bar. With an "action" it can be clicked or dragged
+# along, and action(value) is called once the mouse is let go.
 class progressBar:
-    def __init__(self, x, y, width=200, height=20, min_value=0, max_value=100, current_value=50, colour=colours.COLOUR_INACTIVE):
+    def __init__(self, x, y, width=200, height=20, min_value=0, max_value=100, current_value=50, colour=colours.COLOUR_INACTIVE, action=None):
         self.rect = pg.Rect(x, y, width, height)
         self.colour = colour
         self.min_value = min_value
         self.max_value = max_value
         self.current_value = current_value
+        self.action = action
+        # Whether the bar is being dragged, while it is the value follows the mouse
+        self.held = False
+        # Pre-drawn waveform, unplayed and played, or None for a flat bar
+        self.waveImages = None
+        self.dirty = True
+
+    # Show a waveform in the bar. "peaks" and "rms" hold a level (0-255) per slice of
+    # the track, squeezed here to one column per pixel. Pass None to go back to a flat bar.
+    def setWaveform(self, peaks, rms=None):
+        self.dirty = True
+        if not peaks:
+            self.waveImages = None
+            return
+
+        width, height = self.rect.size
+        middle = height // 2
+        played = tuple(min(255, c + 80) for c in self.colour)
+        self.waveImages = []
+        for peakColour, rmsColour in (((110, 110, 110), (150, 150, 150)), (self.colour, played)):
+            image = pg.Surface(self.rect.size)
+            image.fill((50, 50, 50))
+            for x in range(width):
+                start = x * len(peaks) // width
+                end = max(start + 1, (x + 1) * len(peaks) // width)
+                for levels, colour in ((peaks, peakColour), (rms, rmsColour)):
+                    if levels:
+                        reach = max(levels[start:end]) * (middle - 2) // 255
+                        pg.draw.line(image, colour, (x, middle - reach), (x, middle + reach))
+            self.waveImages.append(image.convert() if pg.display.get_surface() else image)
+
+    # Width in pixels of the filled part of the bar
+    def fillWidth(self):
+        return int((self.current_value - self.min_value) / (self.max_value - self.min_value) * self.rect.width)
 
     def setValue(self, value):
+        oldWidth = self.fillWidth()
         self.current_value = max(self.min_value, min(value, self.max_value))
+        # Only redraw once the bar has moved by at least a pixel
+        if self.fillWidth() != oldWidth:
+            self.dirty = True
+
+    # Value under an x position on the screen
+    def valueAt(self, x):
+        percent = (x - self.rect.x) / self.rect.width
+        return self.min_value + percent * (self.max_value - self.min_value)
 
     def handleEvent(self, event):
-        # No events
-        pass
+        if not self.action:
+            return
+        if event.type == pg.MOUSEBUTTONDOWN and event.button == 1 and self.rect.collidepoint(event.pos):
+            self.held = True
+            self.setValue(self.valueAt(event.pos[0]))
+        elif event.type == pg.MOUSEMOTION and self.held:
+            self.setValue(self.valueAt(event.pos[0]))
+        elif event.type == pg.MOUSEBUTTONUP and event.button == 1 and self.held:
+            self.held = False
+            self.action(self.current_value)
 
     def draw(self, screen):
+        # The waveform is already drawn, so it's just the unplayed one with the played part over it
+        if self.waveImages:
+            screen.blit(self.waveImages[0], self.rect)
+            screen.blit(self.waveImages[1], self.rect, pg.Rect(0, 0, self.fillWidth(), self.rect.height))
+            pg.draw.rect(screen, colours.COLOUR_ACTIVE, self.rect, 2)
+            return self.rect
+
         # Draw the progress bar background
         pg.draw.rect(screen, (50, 50, 50), self.rect)
         
         # Calculate the width of the filled portion based on the current value
-        fill_width = int((self.current_value - self.min_value) / (self.max_value - self.min_value) * self.rect.width)
-        fill_rect = pg.Rect(self.rect.x, self.rect.y, fill_width, self.rect.height)
+        fill_rect = pg.Rect(self.rect.x, self.rect.y, self.fillWidth(), self.rect.height)
         
         # Draw the filled portion
         pg.draw.rect(screen, self.colour, fill_rect)
 
         # Draw the border
         pg.draw.rect(screen, colours.COLOUR_ACTIVE, self.rect, 2)
+        return self.rect
 
     def __str__(self):
-        return f"A progress bar. Width = {self.rect.width}, height = {self.rect.height}. @({self.rect.x},{self.rect.y})"
\ No newline at end of file
+        return f"A progress bar. Width = {self.rect.width}, height = {self.rect.height}. @({self.rect.x},{self.rect.y})"
+
+# ---------- RENDERING ---------- #
+# Draws a list of widgets over a fixed background, only redrawing the ones that
+# changed and only pushing the changed areas to the display.
+# Widgets flag themselves with "dirty"; widgets without that flag are redrawn every frame.
+# An optional profiler (see profiler.py) times each widget and the frame.
+class renderScheduler:
+    def __init__(self, screen, background, widgets, fps=30, profiler=None):
+        self.profiler = profiler
+        self.screen = screen
+        self.background = background
+        self.widgets = widgets
+        self.fps = fps
+        self.clock = pg.time.Clock()
+        self.drawnRects = {}
+        self.fullRedraw = True
+        # When the last frame reached the screen (perf_counter), before the frame cap's sleep
+        self.presentedAt = None
+
+    # Force everything to be redrawn on the next frame (e.g. after switching screens)
+    def invalidate(self):
+        self.fullRedraw = True
+
+    def drawWidget(self, widget):
+        if self.profiler and self.profiler.enabled:
+            with self.profiler.timer("draw " + self.profiler.nameOf(widget)):
+                rect = widget.draw(self.screen)
+        else:
+            rect = widget.draw(self.screen)
+        # Empty rects are falsy, so check for None to tell widgets that report nothing drawn
+        self.drawnRects[widget] = pg.Rect(rect) if rect is not None else self.screen.get_rect()
+        widget.dirty = False
+
+    def render(self):
+        if self.fullRedraw:
+            self.screen.blit(self.background, (0, 0))
+            for widget in self.widgets:
+                self.drawWidget(widget)
+            pg.display.update()
+            self.fullRedraw = False
+        else:
+            # The changed widgets, plus any others overlapping an area that gets cleared.
+            # Those are cleared in full too, or their anti-aliased edges would be drawn
+            # over themselves and get darker, so keep going until nothing new overlaps.
+            dirty = {widget for widget in self.widgets if getattr(widget, "dirty", True)}
+            cleared = [self.drawnRects[widget] for widget in dirty if widget in self.drawnRects]
+            grown = True
+            while grown:
+                grown = False
+                for widget in self.widgets:
+                    if widget not in dirty and widget in self.drawnRects and self.drawnRects[widget].collidelist(cleared) != -1:
+                        dirty.add(widget)
+                        cleared.append(self.drawnRects[widget])
+                        grown = True
+
+            for rect in cleared:
+                self.screen.blit(self.background, rect, rect)
+
+            # Redraw them in order, so overlapping widgets stack the same way as a full redraw
+            updated = list(cleared)
+            for widget in self.widgets:
+                if widget in dirty:
+                    self.drawWidget(widget)
+                    updated.append(self.drawnRects[widget])
+
+            if updated:
+                pg.display.update(updated)
+        self.presentedAt = time.perf_counter()
+
+        # Sleep off the rest of the frame
+        if self.profiler:
+            self.profiler.endFrame()
+        return self.clock.tick(self.fps)
+
+
+# ---------- INPUT DISPATCH ---------- #
+# Routes events to the widgets they affect instead of handing every event to every widget.
+# Mouse events are matched against a grid of cells, so only widgets in the clicked
+# cell are checked. A widget that takes a mouse press keeps getting mouse events until
+# the button is released, and key presses go to whichever widget has focus.
+class eventDispatcher:
+    def __init__(self, cellSize=64, profiler=None):
+        self.cellSize = cellSize
+        self.profiler = profiler
+        self.cells = {}
+        self.placed = {}
+        self.captured = None
+        self.hovered = []
+        self.focus = None
+
+    # Grid cells a rect covers
+    def cellsFor(self, rect):
+        size = self.cellSize
+        return [
+            (cx, cy)
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1)
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1)
+        ]
+
+    # Add a widget, or update where it is after it has moved
+    def place(self, widget):
+        self.remove(widget)
+        cells = self.cellsFor(widget.rect)
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(widget)
+        self.placed[widget] = cells
+
+    def remove(self, widget):
+        for cell in self.placed.pop(widget, []):
+            self.cells[cell].remove(widget)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        if self.focus is widget:
+            self.focus = None
+
+    # Widgets under a point, topmost (last placed) first
+    def widgetsAt(self, pos):
+        cell = (pos[0] // self.cellSize, pos[1] // self.cellSize)
+        return [widget for widget in reversed(self.cells.get(cell, [])) if widget.rect.collidepoint(pos)]
+
+    def send(self, widget, event):
+        if self.profiler and self.profiler.enabled:
+            with self.profiler.timer("event " + self.profiler.nameOf(widget)):
+                widget.handleEvent(event)
+        else:
+            widget.handleEvent(event)
+
+    # Hand an event to the widgets it affects. Returns True if a widget took it.
+    def dispatch(self, event):
+        if event.type == pg.MOUSEBUTTONDOWN:
+            hits = self.widgetsAt(event.pos)
+            # Clicking elsewhere takes focus away from a text box
+            if self.focus and self.focus not in hits:
+                self.send(self.focus, event)
+                self.focus = None
+            if hits:
+                self.captured = hits[0]
+                self.send(hits[0], event)
+                if getattr(hits[0], "takesFocus", False):
+                    self.focus = hits[0]
+                return True
+
+        elif event.type == pg.MOUSEBUTTONUP:
+            target, self.captured = self.captured, None
+            if target:
+                self.send(target, event)
+                return True
+
+        elif event.type == pg.MOUSEMOTION:
+            if self.captured:
+                self.send(self.captured, event)
+                return True
+            # Widgets the mouse just left need to hear about it too, to drop hover effects
+            hits = self.widgetsAt(event.pos)
+            for widget in set(self.hovered + hits):
+                self.send(widget, event)
+            self.hovered = hits
+            return bool(hits)
+
+        elif event.type == pg.MOUSEWHEEL:
+            # Wheel events have no position, so use wherever the mouse is
+            hits = self.widgetsAt(pg.mouse.get_pos())
+            if hits:
+                self.send(hits[0], event)
+                return True
+
+        elif event.type in (pg.KEYDOWN, pg.KEYUP, pg.TEXTINPUT) and self.focus:
+            self.send(self.focus, event)
+            return True
+
+        return False
@@ -0,0 +1,358 @@
+# Persistent track library. Caches tags and lengths in an SQLite file so
+# they only have to be read again when a file actually changes.
+import os
+import sqlite3
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from audioProbe import probeDuration, isAudio, AUDIO_EXTENSIONS
+
+DB_PATH = os.path.join("Data", "library.db")
+
+# How many scanned tracks to write before committing
+COMMIT_EVERY = 500
+
+# Columns in the order they are stored, mapped to the keys used for records
+FIELDS = {
+    "id": "ID",
+    "path": "Path",
+    "mtime": "MTime",
+    "size": "Size",
+    "title": "Title",
+    "artist": "Artist",
+    "album": "Album",
+    "duration": "Duration",
+    "art": "Art",
+    "gain": "Gain"
+}
+
+# Columns added since the first version, added to older library files when they're opened
+ADDED_COLUMNS = {
+    "art": "TEXT",
+    "gain": "REAL"
+}
+
+# One track's record. Uses slots instead of a dict per track, since a big library
+# holds a lot of them, but reads and writes the same way: track["Title"].
+class trackRecord:
+    __slots__ = tuple(FIELDS.values())
+
+    def __init__(self, **values):
+        for key in self.__slots__:
+            setattr(self, key, values.get(key))
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+# Read everything the library stores about one file
+def readTrack(path):
+    stat = os.stat(path)
+    track = trackRecord(
+        Path=path,
+        MTime=stat.st_mtime,
+        Size=stat.st_size,
+        Duration=probeDuration(path, allowDecode=False)
+    )
+
+    # eyed3 is only needed once there's a file to read, so it stays out of startup
+    import eyed3
+    try:
+        song = eyed3.load(path)
+    except Exception as e:
+        print(f"Couldn't read tags for {path}: {e}")
+        song = None
+    if song and song.tag:
+        track["Title"] = song.tag.title
+        track["Artist"] = song.tag.artist
+        track["Album"] = song.tag.album
+    return track
+
+# Read a file's record, or None if it turns out not to be audio
+def readAudio(path):
+    return readTrack(path) if isAudio(path) else None
+
+# Every audio file under some folders, found as the folders are walked instead of all up front.
+# Yields (path, stat). Folders go depth first with their entries sorted, so the order
+# is the same every time. Links are followed, but every file and folder is only
+# visited once, so symlinks, hard links and loops can't repeat a track.
+def walk(roots, seen=None):
+    seen = set() if seen is None else seen
+    stack = list(reversed(roots))
+    while stack:
+        folder = stack.pop()
+        try:
+            stat = os.stat(folder)
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            with os.scandir(folder) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name.casefold())
+        except OSError as e:
+            print(f"Couldn't read {folder}: {e}")
+            continue
+
+        folders = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    folders.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                    stat = entry.stat()
+                    # Windows doesn't fill in inodes from scandir
+                    if not stat.st_ino:
+                        stat = os.stat(entry.path)
+                    if (stat.st_dev, stat.st_ino) not in seen:
+                        seen.add((stat.st_dev, stat.st_ino))
+                        yield entry.path, stat
+            except OSError:
+                continue
+        stack.extend(reversed(folders))
+
+class library:
+    def __init__(self, dbPath=DB_PATH):
+        # The connection is shared by the scanner threads, so guard it with a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbPath, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "path TEXT UNIQUE NOT NULL, "
+            "mtime REAL, size INTEGER, "
+            "title TEXT, artist TEXT, album TEXT, "
+            "duration REAL, "
+            "art TEXT, gain REAL)"
+        )
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(tracks)")}
+        for column, kind in ADDED_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE tracks ADD COLUMN {column} {kind}")
+        self.conn.commit()
+
+    # Turn a database row into a record
+    @staticmethod
+    def toRecord(row):
+        return trackRecord(**dict(zip(FIELDS.values(), row))) if row else None
+
+    # Insert or refresh a file's record, keeping its ID if it already has one.
+    # Anything worked out from the old file, like its cover art or gain, has to be worked out again.
+    def store(self, track):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO tracks (path, mtime, size, title, artist, album, duration, art, gain) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime=excluded.mtime, size=excluded.size, "
+                "title=excluded.title, artist=excluded.artist, album=excluded.album, "
+                "duration=excluded.duration, art=excluded.art, gain=excluded.gain",
+                (track["Path"], track["MTime"], track["Size"], track["Title"],
+                 track["Artist"], track["Album"], track["Duration"], track["Art"], track["Gain"])
+            )
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    # Get a file's record, indexing it first if the library hasn't seen it
+    def get(self, path):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM tracks WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None and os.path.isfile(path):
+            self.store(readTrack(path))
+            self.commit()
+            return self.get(path)
+        return self.toRecord(row)
+
+    # Get a record by its stable ID
+    def getByID(self, trackID):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM tracks WHERE id = ?", (trackID,)
+            ).fetchone()
+        return self.toRecord(row)
+
+    # The paths of some IDs, as {ID: path}. IDs no longer in the library are left out.
+    def pathsOf(self, trackIDs):
+        trackIDs = list(trackIDs)
+        if not trackIDs:
+            return {}
+        with self.lock:
+            return dict(self.conn.execute(
+                f"SELECT id, path FROM tracks WHERE id IN ({', '.join('?' * len(trackIDs))})", trackIDs
+            ).fetchall())
+
+    # The IDs of some paths, as {path: ID}. Paths not in the library are left out.
+    def idsOf(self, paths):
+        paths = list(paths)
+        found = {}
+        with self.lock:
+            # In chunks, to stay under SQLite's limit on parameters
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                found.update(self.conn.execute(
+                    f"SELECT path, id FROM tracks WHERE path IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return found
+
+    # Remember which cover art thumbnail a file uses ("" for none)
+    def setArt(self, path, art):
+        with self.lock:
+            self.conn.execute("UPDATE tracks SET art = ? WHERE path = ?", (art, path))
+            self.conn.commit()
+
+    # Remember a file's length (s), for files whose headers didn't say and had to be decoded
+    def setDuration(self, path, duration):
+        with self.lock:
+            self.conn.execute("UPDATE tracks SET duration = ? WHERE path = ?", (duration, path))
+            self.conn.commit()
+
+    # Remember the gain that evens out a file's loudness (dB)
+    def setGain(self, path, gain):
+        with self.lock:
+            self.conn.execute("UPDATE tracks SET gain = ? WHERE path = ?", (gain, path))
+            self.conn.commit()
+
+    # Forget a file that has been deleted
+    def remove(self, path):
+        with self.lock:
+            self.conn.execute("DELETE FROM tracks WHERE path = ?", (path,))
+
+    # Follow a file that has been renamed or moved, keeping its ID
+    def rename(self, oldPath, newPath):
+        with self.lock:
+            self.conn.execute("DELETE FROM tracks WHERE path = ?", (newPath,))
+            self.conn.execute("UPDATE tracks SET path = ? WHERE path = ?", (newPath, oldPath))
+
+    # Records under any of the roots, SQL matches "prefix" by range so it can use the path index
+    def underRoots(self, columns, roots):
+        rows = []
+        with self.lock:
+            for root in roots:
+                prefix = os.path.join(root, "")
+                rows += self.conn.execute(
+                    f"SELECT {columns} FROM tracks WHERE path >= ? AND path < ?",
+                    (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+                ).fetchall()
+        return rows
+
+    # Every record under some folders
+    def tracks(self, roots):
+        # Keyed by path in case one root is inside another
+        return list({row[1]: self.toRecord(row) for row in self.underRoots(", ".join(FIELDS), roots)}.values())
+
+    # Every path under some folders, with the (mtime, size) it had when it was read
+    def known(self, roots):
+        return {path: (mtime, size) for path, mtime, size in self.underRoots("path, mtime, size", roots)}
+
+    # Every path under some folders, with its ID
+    def ids(self, roots):
+        return dict(self.underRoots("path, id", roots))
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+# Walks some folders in the background, reading new or changed files on a thread pool.
+# Changes are handed to "onChanges(roots, changes)" in small batches as they are found,
+# as ("Added" | "Changed" | "Removed", path, None) tuples, so the first tracks can be
+# played long before a big library has been walked.
+class scanner:
+    # "batchTime" is the longest a found track waits before being handed on (s)
+    def __init__(self, lib, roots, onChanges=None, workers=None, batchTime=0.25):
+        self.lib = lib
+        self.roots = list(roots)
+        self.onChanges = onChanges
+        self.workers = workers
+        self.batchTime = batchTime
+        self.paths = []
+        self.found = 0
+        self.done = 0
+        self.total = 0
+        # Whether every folder has been walked, so "total" won't grow any more
+        self.walked = False
+        self.finished = False
+        # Reads in the order they were started, so tracks are handed on in walk order
+        self.reading = deque()
+        self.batch = []
+        self.lastBatch = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    # Hand on what has been found so far, if it's been long enough or "now" is set
+    def report(self, now=False):
+        if not self.batch or not (now or time.monotonic() - self.lastBatch >= self.batchTime):
+            return
+        self.lib.commit()
+        if self.onChanges:
+            self.onChanges(self.roots, self.batch)
+        self.batch = []
+        self.lastBatch = time.monotonic()
+
+    # Store the tracks the pool has finished reading, waiting for them all if "block" is set
+    def collect(self, block=False):
+        while self.reading and (block or self.reading[0][2].done()):
+            path, isNew, future = self.reading.popleft()
+            self.done += 1
+            try:
+                track = future.result()
+            except OSError as e:
+                print(f"Couldn't index {path}: {e}")
+                continue
+            if track:
+                self.lib.store(track)
+                self.paths.append(path)
+                self.batch.append(("Added" if isNew else "Changed", path, None))
+            elif not isNew:
+                # It used to be audio, but isn't any more
+                self.lib.remove(path)
+                self.batch.append(("Removed", path, None))
+            if self.done % COMMIT_EVERY == 0:
+                self.lib.commit()
+            self.report()
+
+    def run(self):
+        try:
+            known = self.lib.known(self.roots)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for path, stat in walk(self.roots):
+                    self.found += 1
+                    before = known.pop(path, None)
+                    if before == (stat.st_mtime, stat.st_size):
+                        self.paths.append(path)
+                    else:
+                        self.total += 1
+                        self.reading.append((path, before is None, pool.submit(readAudio, path)))
+                    self.collect()
+                self.walked = True
+                self.collect(block=True)
+
+            # Whatever is left in "known" has been deleted or moved
+            for path in known:
+                self.lib.remove(path)
+                self.batch.append(("Removed", path, None))
+        except OSError as e:
+            print(f"Couldn't scan {self.roots}: {e}")
+        finally:
+            self.report(now=True)
+            self.lib.commit()
+            self.finished = True
+
+    # Percentage of changed files read so far. Until the walk is done more files can
+    # still turn up, so it stays at 0 rather than going backwards when they do.
+    def progress(self):
+        if not self.walked:
+            return 0
+        return self.done / self.total * 100 if self.total else 100
@@ -0,0 +1,62 @@
+# Background track loading. A worker thread reads a track's record and file
+# into memory, then posts a TRACK_READY event so the UI thread only has to swap
+# it in. Nothing on the UI thread waits on the disk. Tracks with a local copy
+# in the track cache are mapped from there instead of being read.
+import io
+import queue
+import threading
+import pygame as pg
+
+from audioProbe import probeDuration
+
+TRACK_READY = pg.USEREVENT + 2
+
+class trackLoader:
+    def __init__(self, lib, cache=None):
+        self.lib = lib
+        self.cache = cache
+        self.requests = queue.Queue()
+        # Newest request number for each kind, so results for skipped tracks are dropped
+        self.latest = {"Play": 0, "Queue": 0}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Ask for a track to be prepared. "kind" is "Play" to start it, or "Queue" to line it up next.
+    def request(self, ID, path, kind="Play"):
+        self.latest[kind] += 1
+        # A new track to play means whatever was being queued is out of date too
+        if kind == "Play":
+            self.latest["Queue"] += 1
+        self.requests.put((kind, self.latest[kind], ID, path))
+
+    # Whether a TRACK_READY event is still the newest result of its kind
+    def isCurrent(self, event):
+        return event.token == self.latest[event.kind]
+
+    def run(self):
+        while True:
+            kind, token, ID, path = self.requests.get()
+            if token != self.latest[kind]:
+                continue
+
+            try:
+                track = self.lib.get(path)
+                if not track:
+                    raise OSError(f"{path} is missing")
+                if not track["Duration"]:
+                    track["Duration"] = probeDuration(path)
+                    # Decoding a whole file is slow, so keep the result and only ever do it once
+                    if track["Duration"]:
+                        self.lib.setDuration(path, track["Duration"])
+                data = self.cache.open(path) if self.cache else None
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = io.BytesIO(f.read())
+                error = None
+            except (OSError, pg.error) as e:
+                track, data, error = None, None, str(e)
+
+            pg.event.post(pg.event.Event(
+                TRACK_READY, kind=kind, token=token, ID=ID, path=path,
+                track=track, data=data, error=error
+            ))
@@ -0,0 +1,226 @@
+# Loudness normalisation. Each track gets a gain in dB that brings it to the same
+# loudness as the others. It comes from the track's ReplayGain or R128 tags when
+# it has them, otherwise a worker thread decodes the track and measures it with
+# NumPy. Either way the gain is saved in the library, so it's only ever worked
+# out once per track and applying it is just a volume change.
+import os
+import queue
+import struct
+import threading
+import pygame as pg
+
+# NumPy does the measuring. Without it, tracks without tags play at their own level.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GAIN_READY = pg.USEREVENT + 6
+
+# Loudness everything is brought to, the ReplayGain 2.0 reference (LUFS)
+TARGET = -18.0
+# R128 tags are relative to -23 LUFS
+R128_REFERENCE = -23.0
+
+# Length of the loudness blocks and of the steps between them (s), from ITU-R BS.1770
+BLOCK = 0.4
+STEP = 0.1
+# Steps worked on at once, so a long track isn't copied to floats all in one go
+CHUNK = 600
+
+# ---- Tags ---- #
+# Read "-6.54 dB" style gain text
+def parseGain(text):
+    try:
+        return float(text.strip().split()[0])
+    except (ValueError, IndexError, AttributeError):
+        return None
+
+# Pull name=value pairs out of a Vorbis comment block
+def parseComments(data, offset=0):
+    comments = {}
+    vendorLength, = struct.unpack_from("<I", data, offset)
+    offset += 4 + vendorLength
+    count, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    for _ in range(count):
+        length, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        name, _, value = data[offset:offset + length].decode("utf-8", "replace").partition("=")
+        comments[name.upper()] = value
+        offset += length
+    return comments
+
+def flacComments(f):
+    if f.read(4) != b"fLaC":
+        return {}
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            return {}
+        last, kind, length = header[0] & 0x80, header[0] & 0x7F, int.from_bytes(header[1:], "big")
+        if kind == 4:
+            return parseComments(f.read(length))
+        if last:
+            return {}
+        f.seek(length, os.SEEK_CUR)
+
+# The comment header is the second packet of an Ogg stream, so it's in the first few pages
+def oggComments(f):
+    body = b""
+    for _ in range(8):
+        header = f.read(27)
+        if len(header) < 27 or header[:4] != b"OggS":
+            break
+        segments = f.read(header[26])
+        body += f.read(sum(segments))
+        for marker in (b"\x03vorbis", b"OpusTags"):
+            start = body.find(marker)
+            if start != -1:
+                try:
+                    return parseComments(body, start + len(marker))
+                except struct.error:
+                    # The packet goes on into the next page
+                    break
+    return {}
+
+# A track's gain from its tags (dB), or None if it doesn't have any
+def tagGain(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".mp3":
+        import eyed3
+        song = eyed3.load(path)
+        if song and song.tag:
+            frame = song.tag.user_text_frames.get("REPLAYGAIN_TRACK_GAIN")
+            if frame:
+                return parseGain(frame.text)
+        return None
+
+    with open(path, "rb") as f:
+        if ext == ".flac":
+            comments = flacComments(f)
+        elif ext in (".ogg", ".oga", ".opus"):
+            comments = oggComments(f)
+        else:
+            return None
+
+    if "REPLAYGAIN_TRACK_GAIN" in comments:
+        return parseGain(comments["REPLAYGAIN_TRACK_GAIN"])
+    if "R128_TRACK_GAIN" in comments:
+        # A Q7.8 number of dB, relative to -23 LUFS instead of -18
+        try:
+            return int(comments["R128_TRACK_GAIN"]) / 256 + TARGET - R128_REFERENCE
+        except ValueError:
+            return None
+    return None
+
+# ---- Measuring ---- #
+# How much the BS.1770 K-weighting filter scales the power at some frequencies.
+# Working it out per frequency lets the filter be applied to FFTs instead of
+# running the IIR filter over every sample, which NumPy can't do quickly.
+def kWeighting(frequencies, rate):
+    z = np.exp(-2j * np.pi * frequencies / rate)
+
+    # High shelf, boosting the treble by about 4 dB
+    k = np.tan(np.pi * 1681.974450955533 / rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ((vh + vb * k / q + k * k) + 2 * (k * k - vh) * z + (vh - vb * k / q + k * k) * z * z) / \
+            (a0 + 2 * (k * k - 1) * z + (1 - k / q + k * k) * z * z)
+
+    # High pass, cutting the rumble below about 38 Hz
+    k = np.tan(np.pi * 38.13547087602444 / rate)
+    q = 0.5003270373238773
+    highPass = (1 - 2 * z + z * z) * (1 + k / q + k * k) / \
+               ((1 + k / q + k * k) + 2 * (k * k - 1) * z + (1 - k / q + k * k) * z * z)
+
+    return np.abs(shelf * highPass) ** 2
+
+# Integrated loudness of some samples (LUFS), gated like BS.1770, or None if it's all silence
+def integratedLoudness(samples, rate):
+    samples = samples.reshape(len(samples), -1)
+    step = int(rate * STEP)
+    steps = len(samples) // step
+    blockSteps = round(BLOCK / STEP)
+    if steps < blockSteps:
+        return None
+
+    # Mean square of each 100 ms step after weighting, summed over the channels
+    weights = kWeighting(np.fft.rfftfreq(step, 1 / rate), rate)
+    # Parseval: every bin but the first (and last, for even lengths) stands for two
+    weights[1:(step + 1) // 2] *= 2
+    power = np.empty(steps)
+    for start in range(0, steps, CHUNK):
+        count = min(CHUNK, steps - start)
+        block = np.asarray(samples[start * step:(start + count) * step], dtype=np.float32) / 32768
+        spectrum = np.fft.rfft(block.reshape(count, step, -1), axis=1)
+        power[start:start + count] = (np.abs(spectrum) ** 2 * weights[:, None]).sum(axis=(1, 2)) / step ** 2
+
+    # 400 ms blocks overlapping by 75%, each the mean of four steps
+    blocks = np.convolve(power, np.ones(blockSteps) / blockSteps, mode="valid")
+    loudness = -0.691 + 10 * np.log10(np.maximum(blocks, 1e-12))
+
+    # Leave out silence, then anything more than 10 LU below the average of what's left
+    gated = blocks[loudness > -70]
+    if not len(gated):
+        return None
+    gated = blocks[loudness > -0.691 + 10 * np.log10(gated.mean()) - 10]
+    return -0.691 + 10 * np.log10(gated.mean())
+
+# Decode a track and work out its gain (dB)
+def measureGain(path):
+    sound = pg.mixer.Sound(path)
+    samples = pg.sndarray.samples(sound)
+    rate, size, _ = pg.mixer.get_init()
+    # sndarray hands back whatever sample type the mixer uses, so bring it to 16 bit's range
+    if abs(size) == 8:
+        samples = (samples.astype(np.int16) - (128 if size > 0 else 0)) * 256
+    elif abs(size) == 32:
+        samples = samples * 32768 if samples.dtype.kind == "f" else samples / 65536
+    loudness = integratedLoudness(samples, rate)
+    return 0.0 if loudness is None else TARGET - loudness
+
+# Volume to give the mixer for a track, from the user's volume and the track's gain.
+# The mixer can't go above full volume, so quiet tracks are only brought up as far as that.
+def applyGain(volume, gain):
+    return min(1.0, volume * 10 ** ((gain or 0) / 20))
+
+class gainWorker:
+    def __init__(self, lib):
+        self.lib = lib
+        self.requests = queue.Queue()
+        # Gains worked out this session, for track records read before they were saved
+        self.found = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # A track's gain if it's known yet (dB), otherwise None, and it gets worked out
+    # in the background. A GAIN_READY event follows once it has been.
+    def gainFor(self, track):
+        gain = track["Gain"]
+        if gain is None:
+            gain = self.found.get(track["Path"])
+        if gain is None:
+            self.requests.put(track["Path"])
+        return gain
+
+    def run(self):
+        while True:
+            path = self.requests.get()
+            if path in self.found:
+                continue
+            try:
+                gain = tagGain(path)
+                if gain is None and np is not None:
+                    gain = measureGain(path)
+            except Exception as e:
+                print(f"Couldn't work out the loudness of {path}: {e}")
+                gain = None
+            # Don't try again every time it's played
+            gain = gain or 0.0
+
+            self.found[path] = gain
+            self.lib.setGain(path, gain)
+            pg.event.post(pg.event.Event(GAIN_READY, path=path, gain=gain))
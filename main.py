@@ -1,12 +1,36 @@
 # Import necessary modules
 import os
 import json
+import time
+# Taken first so the startup report covers the imports too
+launchTime = time.perf_counter()
+import threading
+import queue
 import pygame as pg
-from random import randint
-import eyed3
 
 # Import custom module for IO methods
 import ioMethods as io
+import playback
+from shuffle import shuffleOrder, SHUFFLE_PATH
+from stateStore import stateStore
+from profiler import profiler, overlay, startupTimer
+from library import library, scanner
+from loader import trackLoader, TRACK_READY
+from search import searchIndex
+from pathTable import pathTable
+from watcher import folderWatcher, postChanges, LIBRARY_CHANGED
+from waveform import waveformCache, WAVEFORM_READY
+from albumArt import artCache, ART_READY
+from loudness import gainWorker, applyGain, GAIN_READY
+from trackCache import trackCache, CACHE_BYTES, CACHE_AHEAD
+from playHistory import playHistory
+
+# How long each step of starting up takes, printed once the first frame is up
+startup = startupTimer(launchTime)
+startup.mark("Imports")
+
+# Posted once the playlist has been read from the library index
+LIBRARY_LOADED = pg.USEREVENT + 7
 
 # Define the version number
 verTxt = "0.0.1"
@@ -23,6 +47,7 @@ class colours:
 # Initialize global variables
 initialised = None
 playlistPath = None
+libraryRoots = []
 shuffling = None
 looping = None
 songInfo = {
@@ -31,13 +56,54 @@ songInfo = {
     "SongArtist": "ArtistName",
     "Length": None
 }
-playlist = []
+playlist = pathTable()
+queuedID = None
+queuedSong = None
+shuffler = shuffleOrder()
+lib = library()
+libScan = None
+folderWatch = None
+# Set until the last song has been found and started again
+waitingToPlay = False
+# Local copies of the next few songs, for music on slow drives or network shares
+localCopies = trackCache()
+songLoader = trackLoader(lib, localCopies)
+waveforms = waveformCache()
+# The track whose waveform the progress bar is showing or waiting for
+waveformPath = None
+coverArt = artCache(lib)
+gains = gainWorker(lib)
+# Gain that evens out the current song's loudness (dB), on top of the volume
+trackGain = 0.0
+searcher = searchIndex()
+searchResults = []
+lastQuery = ""
 paused = False
-currentPos = 1
 msLen = 1
+volume = 1.0
 
-# Initialize Pygame
-pg.init()
+# Where to start the saved song from once it has loaded, in ms
+resumePos = 0
+shuffleCursor = -1
+
+# State is saved in the background, and at least this often while playing (ms)
+CFG_PATH = os.path.join("Data", "cfg.json")
+SAVE_INTERVAL = 5000
+store = stateStore()
+lastSave = 0
+
+# What was played, for how long and whether it was skipped
+history = playHistory(lib)
+
+# Hot path timings, shown with F3 and dumped to a trace file with F4
+prof = profiler()
+debug = False
+
+# Initialize only the parts of Pygame the player uses. pg.init() would also bring
+# up joysticks and the like, which can take a while to probe.
+pg.display.init()
+pg.font.init()
+pg.mixer.init()
 
 # Set the screen resolution
 resolution = (400, 600)
@@ -49,113 +115,407 @@ pg.display.set_icon(pg.image.load("Icons/unpause.png"))
 CENTRE_X = resolution[0]//2
 CENTRE_Y = resolution[1]//2
 
+# Frame rate cap for every screen
+FPS = 30
+
+# Music output
+engine = playback.player()
+
 # Initialize Pygame clock
 clock = pg.time.Clock()
+startup.mark("Pygame and window")
 
 # Function to unpack data from the configuration file
 def dataUnpacker():
-    with open(os.path.join("Data", "cfg.json"), "r") as cfgFile:
+    with open(CFG_PATH, "r") as cfgFile:
         rawData = cfgFile.read()
         data = json.loads(rawData)
 
-    global initialised, playlistPath, shuffling, looping, songInfo, playlist
+    global initialised, playlistPath, libraryRoots, shuffling, looping, songInfo, volume, resumePos, shuffleCursor, debug
     initialised = data["Initialised"]
     playlistPath = data["PlaylistPath"]
+    # Older configs only have the one folder
+    libraryRoots = data.get("LibraryRoots") or ([playlistPath] if playlistPath else [])
     shuffling = data["Shuffling"]
     looping = data["Looping"]
     songInfo = data["SongInfo"]
+    volume = data.get("Volume", 1.0)
+    resumePos = data.get("Position", 0)
+    shuffleCursor = data.get("ShuffleCursor", -1)
+    debug = data.get("Debug", False)
+    localCopies.maxBytes = data.get("CacheBytes", CACHE_BYTES)
+    localCopies.ahead = data.get("CacheAhead", CACHE_AHEAD)
 
-    playlist = [os.path.join(playlistPath, item) for item in os.listdir(playlistPath)]
+    volumeSlider.setValue(round(volume * 100))
+    updateVolume()
 
-# Function to pack data into the configuration file
-def dataPacker():
+    if initialised:
+        startLibrary()
+
+# Function to load the playlist from the library index, then walk the library
+# folders in the background for anything that changed since last time. The index
+# is read on a thread of its own so the window is up before a big library is,
+# and the playlist arrives as a LIBRARY_LOADED event. New tracks from the walk
+# arrive as LIBRARY_CHANGED events, so on a first run the player starts as soon
+# as the first track is found.
+def startLibrary():
+    global folderWatch
+    if folderWatch:
+        folderWatch.stop()
+        folderWatch = None
+    threading.Thread(target=loadLibrary, args=(list(libraryRoots), shuffleCursor), daemon=True).start()
+
+def loadLibrary(roots, cursor):
+    ids = lib.ids(roots)
+    # Sorted so IDs don't depend on the order the OS lists files in
+    sortedPaths = sorted(ids)
+    paths = pathTable(sortedPaths)
+    order = shuffleOrder.load([ids[path] for path in sortedPaths], cursor)
+    pg.event.post(pg.event.Event(LIBRARY_LOADED, roots=roots, playlist=paths, shuffler=order))
+
+# Function to take over the playlist read by loadLibrary and start the library walk
+def libraryLoaded(event):
+    global playlist, shuffler, libScan, waitingToPlay
+    # The folders were changed while it was being read
+    if event.roots != libraryRoots:
+        return
+    playlist = event.playlist
+    shuffler = event.shuffler
+    trackListView.setCount(len(playlist))
+    requestIndex()
+    playerRender.invalidate()
+
+    libScan = scanner(lib, libraryRoots, onChanges=postChanges).start()
+    waitingToPlay = True
+    startPlayback()
+
+# Function to start the last song again once it's in the playlist. It's found by
+# its path, since files may have come or gone since last time.
+def startPlayback():
+    global waitingToPlay
+    if not waitingToPlay or not playlist:
+        return
+
+    path = songInfo.get("Path")
+    if songInfo["ID"] < 0:
+        # A first run, so start on the first track found, or the first of the shuffle
+        nextID = shuffler.peekNext() if shuffling else None
+        songInfo["ID"] = playlist.first() if nextID is None else nextID
+    elif path in playlist:
+        songInfo["ID"] = playlist.find(path)
+    elif path and libScan:
+        # The library walk may still turn it up
+        return
+    elif not (0 <= songInfo["ID"] < len(playlist) and playlist[songInfo["ID"]]):
+        songInfo["ID"] = playlist.first()
+    waitingToPlay = False
+    playSong(songInfo["ID"])
+
+# Function to wrap up once the library walk is done
+def finishScan():
+    global libScan, folderWatch
+    libScan = None
+    # Pick up changes to the folders from now on
+    folderWatch = folderWatcher(libraryRoots, lib).start()
+    # If the last song never turned up, play something else
+    startPlayback()
+
+# The search index is brought up to date by one background thread, however often
+# it's asked to. Only tracks that changed since the last time get re-indexed.
+# The thread gets its own copy of the playlist, since the UI thread changes it as files come and go.
+indexRequests = queue.Queue()
+
+# Function to have the search index catch up with the playlist as it is now
+def requestIndex():
+    indexRequests.put((list(libraryRoots), playlist.copy()))
+
+def indexLibrary():
+    while True:
+        roots, paths = indexRequests.get()
+        # Only the newest playlist matters
+        while not indexRequests.empty():
+            roots, paths = indexRequests.get_nowait()
+        try:
+            searcher.sync([track for track in lib.tracks(roots) if track["Path"] in paths])
+        except Exception as e:
+            print(f"Couldn't index the library: {e}")
+
+threading.Thread(target=indexLibrary, daemon=True).start()
+
+# Function to apply files being added, removed or renamed, by the library walk or
+# while the player runs. IDs never move: new files go on the end and removed ones leave a gap.
+def applyChanges(event):
+    if event.roots != libraryRoots:
+        return
+    wasEmpty = not playlist
+    added = []
+    renamed = []
+    removed = []
+    for kind, path, oldPath in event.changes:
+        if kind == "Renamed" and oldPath in playlist:
+            ID = playlist.find(oldPath)
+            playlist[ID] = path
+            renamed.append(ID)
+            if ID == songInfo["ID"]:
+                songInfo["Path"] = path
+                songInfo["SongName"] = os.path.basename(path)
+        elif kind in ("Added", "Renamed", "Changed") and path not in playlist:
+            playlist.append(path)
+            added.append(path)
+        elif kind == "Removed" and path in playlist:
+            ID = playlist.find(path)
+            playlist[ID] = None
+            removed.append(ID)
+
+    # All at once, so deleting a big folder doesn't rebuild the shuffle order per track
+    shuffler.discardMany(removed)
+    # The shuffle is saved by library ID. 0 is never one, for a file the library lost in the meantime.
+    ids = lib.idsOf(added)
+    shuffler.grow([ids.get(path, 0) for path in added])
+    trackListView.setCount(len(playlist))
+    requestIndex()
+    if wasEmpty:
+        playerRender.invalidate()
+
+    startPlayback()
+    # Queue again only if the queued song's file has gone or moved, or it's no longer next
+    if engine.current and not waitingToPlay and (queuedID in removed or queuedID in renamed or pickNext() != queuedID):
+        queueNext()
+
+# Function to pack data into the configuration file. Saving happens in the
+# background unless "now" is set.
+def dataPacker(now=False):
+    global lastSave
     data = {
         "Initialised": initialised,
         "PlaylistPath": playlistPath,
+        "LibraryRoots": libraryRoots,
         "Shuffling": shuffling,
         "Looping": looping,
-        "SongInfo": songInfo
+        "SongInfo": songInfo,
+        "Position": songPos(),
+        "Volume": volume,
+        "ShuffleCursor": shuffler.cursor,
+        "Debug": debug,
+        "CacheBytes": localCopies.maxBytes,
+        "CacheAhead": localCopies.ahead
     }
-
-    with open(os.path.join("Data", "cfg.json"), "w") as cfgFile:
-        json.dump(data, cfgFile, indent=4)
-
-# Function to play a selected song by ID
+    store.save(CFG_PATH, json.dumps(data, indent=4).encode())
+
+    # The shuffle order is bulky, so it only gets rewritten when it changes
+    if shuffler.size and shuffler.changed:
+        store.save(SHUFFLE_PATH, shuffler.toBytes())
+
+    lastSave = pg.time.get_ticks()
+    if now:
+        store.flush()
+
+# Function to set the mixer's volume from the volume setting and the song's gain
+def updateVolume():
+    pg.mixer.music.set_volume(applyGain(volume, trackGain))
+
+# Function to change the volume, as a percentage
+def setVolume(percent):
+    global volume
+    volume = max(0, min(percent, 100)) / 100
+    volumeSlider.setValue(round(volume * 100))
+    updateVolume()
+    dataPacker()
+
+# Function to get how far into the current song playback is, in ms
+def songPos():
+    # Until the resumed song has loaded, the position is still the saved one
+    if resumePos:
+        return resumePos
+    return engine.position() * 1000
+
+# Function to play a selected song by ID. The song is loaded in the background
+# and starts when its TRACK_READY event arrives.
+@prof.timed("playSong")
 def playSong(ID):
-    if 0 <= ID < len(playlist):
+    if 0 <= ID < len(playlist) and playlist[ID]:
         songPath = playlist[ID]
         print(songPath)
+        prof.mark("Track switch")
 
-        if os.path.exists(songPath):
-            pg.mixer.music.stop()
-
-            pg.mixer.music.load(songPath)
-            pg.mixer.music.play()
-
-            if paused:
-                pg.mixer.music.pause()
-
-        global currentPos, msLen
-        msLen = pg.mixer.Sound(songPath).get_length() * 1000
-        currentPos = msLen - pg.mixer.music.get_pos()
-
-        hours, remainder = divmod(int(msLen // 1000), 3600)
-        minutes, seconds = divmod(remainder, 60)
+        if shuffling:
+            shuffler.moveTo(ID)
+        songLoader.request(ID, songPath)
+    else:
+        print("Error: SongID not in Playlist")
 
-        formatted_length = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        songInfo["Length"] = formatted_length
+# Function to jump straight to a song, e.g. one picked from a list
+def selectSong(ID):
+    songInfo["ID"] = ID
+    playSong(ID)
+
+# Function to swap in a song the loader has finished preparing
+@prof.timed("trackReady")
+def trackReady(event):
+    if not songLoader.isCurrent(event):
+        return
+    if event.error:
+        errorText.setText(f"Error: {event.error}")
+        return
+
+    global queuedID, queuedSong, resumePos
+    if event.kind == "Play":
+        # The old song plays until now, and stopping it before it finished makes it a skip
+        history.end(skipped=True)
+        try:
+            engine.play(event.path, paused, event.data, resumePos / 1000)
+        except pg.error as e:
+            # One file that won't decode shouldn't stop the player, so move on from it
+            errorText.setText(f"Error: {e}")
+            resumePos = 0
+            songInfo["ID"] = event.ID
+            queuedID = None
+            nextSong()
+            return
+        history.begin(event.track["ID"], paused)
+        resumePos = 0
+        showSong(event.ID, event.track)
+        queueNext()
+        prof.finish("Track switch")
+    else:
+        engine.queue(event.path, event.data)
+        queuedSong = (event.ID, event.track)
+        # Have the gain ready for when it takes over
+        gains.gainFor(event.track)
+
+# Function to fill in songInfo for the song that is now playing
+def showSong(ID, track):
+    global msLen, waveformPath, trackGain
+    msLen = track["Duration"] * 1000 or 1
+    # Until an unmeasured song's gain is known it plays at its own level
+    trackGain = gains.gainFor(track) or 0.0
+    updateVolume()
+
+    hours, remainder = divmod(int(msLen // 1000), 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    formatted_length = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    songInfo["Length"] = formatted_length
+
+    songInfo["SongArtist"] = track["Artist"] or "Unknown Artist"
+    if waveformPath != track["Path"]:
+        # Flat until this track's waveform turns up
+        waveformPath = track["Path"]
+        progBar.setWaveform(None)
+        waveforms.request(waveformPath)
+        # Art already in memory goes straight up, anything else comes from the worker
+        artImage.setImage(coverArt.cached(track["Art"]))
+        if artImage.image is None and track["Art"] != "":
+            coverArt.request(waveformPath)
+    songInfo["Path"] = track["Path"]
+    songInfo["SongName"] = os.path.basename(track["Path"])
+    songIDTxt.setText(f"ID: {ID}")
+    dataPacker()
+
+# Function to work out which song comes after the current one.
+# Returns None if the playlist has run out and isn't looping.
+def pickNext(inc=1, fromID=None):
+    if not playlist:
+        return None
 
-        song = eyed3.load(songPath)
-        if song.tag:
-            name = song.tag.artist
-            if name:
-                songInfo["SongArtist"] = name
+    if shuffling:
+        return shuffler.peekNext() if inc > 0 else shuffler.peekBack()
+
+    # Step over the gaps left by removed files
+    newID = songInfo["ID"] if fromID is None else fromID
+    while True:
+        newID += inc
+        if newID >= len(playlist):
+            if not looping:
+                return None
+            newID = 0
+        elif newID < 0:
+            if not looping:
+                newID, inc = 0, 1
             else:
-                songInfo["SongArtist"] = "Unknown Artist"
+                newID = len(playlist) - 1
+        if playlist[newID]:
+            return newID
 
-        songInfo["SongName"] = os.listdir(playlistPath)[ID]
-        songIDTxt.setText(f"ID: {songInfo['ID']}")
-    else:
-        print("Error: SongID not in Playlist")
+# Function to list the next "count" songs, in the order they'll play
+def upcomingIDs(count):
+    if shuffling:
+        return shuffler.peekAhead(count)
+    IDs = []
+    ID = songInfo["ID"]
+    while len(IDs) < count:
+        ID = pickNext(fromID=ID)
+        # A short looping playlist comes back round
+        if ID is None or ID in IDs:
+            break
+        IDs.append(ID)
+    return IDs
+
+# Function to preload the next song so it starts the moment this one ends,
+# and have the ones after it copied somewhere quick if they're on a slow drive
+def queueNext():
+    global queuedID
+    queuedID = pickNext()
+    if queuedID is not None:
+        songLoader.request(queuedID, playlist[queuedID], "Queue")
+        # The loader reads the queued song itself, so start from the one after
+        localCopies.prefetch([playlist[ID] for ID in upcomingIDs(localCopies.ahead + 1)[1:]])
 
 # Function to play the next song
+@prof.timed("nextSong")
 def nextSong(inc=1):
-    if shuffling:
-        oldID = songInfo["ID"]
-        while songInfo["ID"] == oldID:
-            songInfo["ID"] = randint(0, len(playlist) - 1)
-    else:
-        songInfo["ID"] += inc
+    # Skipping forwards plays whatever was already queued
+    newID = queuedID if inc == 1 and queuedID is not None else pickNext(inc)
+    if newID is None:
+        return
 
-        if songInfo["ID"] > len(playlist):
-            if looping:
-                songInfo["ID"] = 0
-            else:
-                paused = True
-                songInfo["ID"] = len(playlist) - 1
-        elif songInfo["ID"] < 0:
-            if looping:
-                songInfo["ID"] = len(playlist) - 1
-            else:
-                songInfo["ID"] = 0
+    songInfo["ID"] = newID
     playSong(songInfo["ID"])
 
+# Function to move on when the queued song takes over from the last one
+def songEnded(event):
+    # Playing to the end isn't a skip
+    history.end()
+    if engine.handleEvent(event):
+        # Go by what is actually in the mixer's queue, which can lag behind queuedID
+        songInfo["ID"], track = queuedSong
+        history.begin(track["ID"], paused)
+        if shuffling:
+            shuffler.moveTo(songInfo["ID"])
+        showSong(songInfo["ID"], track)
+        queueNext()
+    else:
+        nextSong()
+
 # Function to toggle pause/play
 def togglePause():
     global paused
     if paused:
-        pg.mixer.music.unpause()
-        pause_icon.image = pg.transform.scale(pg.image.load("Icons/pause.png"), (16*5, 16*5))
+        engine.unpause()
+        pause_icon.setImage(io.loadImage("Icons/pause.png", ICON_SCALE))
         paused = False
     else:
-        pg.mixer.music.pause()
-        unpause_icon = pg.transform.scale(pg.image.load("Icons/unpause.png"), (16*5, 16*5))
-        
-        # Calculate the x-position to center the button
-        pause_icon.rect.x = resolution[0] // 2 - unpause_icon.get_width() // 2
-        
-        pause_icon.image = unpause_icon
+        engine.pause()
+        pause_icon.setImage(io.loadImage("Icons/unpause.png", ICON_SCALE))
         paused = True
+    history.setPaused(paused)
+
+    # Keep the button centred and let the input grid know where it is now
+    pause_icon.rect.size = pause_icon.image.get_size()
+    pause_icon.centre(sc, xPos=resolution[0] // 2)
+    pause_icon.centre(sc, yPos=520)
+    playerInput.place(pause_icon)
+    dataPacker()
+
+# Function to jump to a point in the current song, given as a percentage
+def seekTo(percentage):
+    if engine.current is None or resumePos:
+        return
+    engine.seek(percentage / 100 * msLen / 1000)
+    # Restarting the song to seek drops whatever was queued after it
+    if engine.queued is None:
+        queueNext()
+    dataPacker()
 
 # ---- Shared UI ---- #
 ver = io.text(0, 0, f"Music Player {verTxt}")
@@ -167,121 +527,341 @@ fpBox = io.inputBox(20, resolution[1]//2 - 32//2, prompt="Input playlist directo
 
 initUI = [ver, fpBox, fpPrompt, errorText]
 
+# ---- Library Scan UI ---- #
+scanPrompt = io.text(20, resolution[1]//2 - 20, "Scanning library...")
+scanBar = io.progressBar(20, resolution[1]//2, resolution[0] - 40, colour=colours.PROG_C)
+
+scanUI = [ver, scanPrompt, scanBar]
+
 # ---- Music Player UI ---- #
-progBar = io.progressBar(0, resolution[1] - resolution[1]//3, resolution[0], colour=colours.PROG_C)
-minTime = io.text(2, resolution[1] - resolution[1]//3 + 22, "00:00:00")
-maxTime = io.text(resolution[0] - 35, resolution[1] - resolution[1]//3 + 22, "0:00")
+progBar = io.progressBar(0, resolution[1] - resolution[1]//3, resolution[0], 36, colour=colours.PROG_C, action=seekTo)
+minTime = io.text(2, resolution[1] - resolution[1]//3 + 38, "00:00:00")
+maxTime = io.text(resolution[0] - 35, resolution[1] - resolution[1]//3 + 38, "0:00")
 songNameTxt = io.text(0, 0, songInfo["SongName"], 2)
 artistNameTxt = io.text(0, 0, songInfo["SongArtist"], 1)
 songIDTxt = io.text(resolution[0] - 45, 110, f"ID: {songInfo['ID']}")
+artImage = io.picture(resolution[0]//2 - 80, 145, 160, 160)
+volumeSlider = io.inputSlider(resolution[0]//2 - 100, 584, 200, 6, default_value=100, action=setVolume)
 
 shufflingTxt = io.text(0, 24, f"Shuffling: {shuffling}")
 loopingTxt = io.text(0, 48, f"Looping: {looping}")
 
 # Load Icons
+ICON_SCALE = 5
+io.preloadImages(["Icons/backSong.png", "Icons/forwardSong.png", "Icons/pause.png", "Icons/unpause.png"], ICON_SCALE)
+
 back_icon = io.button(resolution[0]//2 - 140, 480, "Icons/backSong.png", action=lambda: nextSong(-1))
 forward_icon = io.button(resolution[0]//2 + 60, 480, "Icons/forwardSong.png", action=nextSong)
 pause_icon = io.button(resolution[0]//2 - 40, 480, "Icons/pause.png", action=togglePause)
 
-musicPlayerUI = [ver, errorText, progBar, minTime, maxTime, back_icon, forward_icon, pause_icon, songNameTxt, artistNameTxt, songIDTxt, loopingTxt, shufflingTxt]
-
-dataUnpacker()
-
-playSong(songInfo["ID"])
-togglePause()
-
-running = True
-while running:
-    # Draw regular UI
-    if initialised:
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                running = False
-            elif event.type == pg.KEYDOWN:
-                oldID = songInfo["ID"]
-                if event.key == pg.K_RIGHT:
-                    try:
-                        nextSong()
-                    except Exception as e:
-                        errorText.setText(str(e))
-                        songInfo["ID"] = oldID + 1
-                elif event.key == pg.K_LEFT and not songInfo["ID"]-1 < 0:
-                    try:
-                        nextSong(-1)
-                    except Exception as e:
-                        errorText.setText(str(e))
-                        songInfo["ID"] = oldID - 1
-                elif event.key == pg.K_SPACE:
-                    togglePause()
-                elif event.key == pg.K_F1:
-                    shuffling = not shuffling
-                elif event.key == pg.K_F2:
-                    looping = not looping
-        perc = (pg.mixer.music.get_pos() / msLen) * 100
-        if perc < 0:
-            nextSong()
-
-        hours, remainder = divmod(int(pg.mixer.music.get_pos() // 1000), 3600)
-        minutes, seconds = divmod(remainder, 60)
-        formatted_length = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-
-        # Configure variable UI
-        maxTime.x = sc.get_width() - maxTime.textSurface.get_width() - 2
-        songNameTxt.centre(sc, yPos=100)
-        artistNameTxt.centre(sc, yPos=350)
-        pause_icon.centre(sc, yPos=520)
-        
-        songNameTxt.setText(songInfo["SongName"])
-        artistNameTxt.setText(songInfo["SongArtist"])
-        maxTime.setText(songInfo["Length"])
-        minTime.setText(formatted_length)
-        shufflingTxt.setText(f"Shuffling [F1 Toggle]: {shuffling}")
-        loopingTxt.setText(f"Looping [F2 Toggle]: {looping}")
-
-        percentage = (pg.mixer.music.get_pos() / msLen) * 100
-        progBar.setValue(percentage)
-        #print(progBar.current_value)
-
-        # Background
-        sc.fill(colours.BG1_C)
-        pg.draw.rect(sc, colours.BG2_C, pg.Rect(0, resolution[1] - resolution[1]//3, resolution[0], resolution[1]//3))
-
-        pg.draw.circle(sc, colours.BG1_C, (resolution[0]//2, 520), 50)
-        pg.draw.circle(sc, (0, 0, 0), (resolution[0]//2, 520), 50, 2)
-        for element in musicPlayerUI:
-            element.draw(sc)
-
-            if isinstance(element, io.button):
-                element.handleEvent()
-
-    # Draw initialisation UI
+musicPlayerUI = [ver, errorText, progBar, minTime, maxTime, back_icon, forward_icon, pause_icon, songNameTxt, artistNameTxt, songIDTxt, artImage, volumeSlider, loopingTxt, shufflingTxt]
+
+# The player background never changes, so draw it once
+playerBG = pg.Surface(resolution)
+playerBG.fill(colours.BG1_C)
+pg.draw.rect(playerBG, colours.BG2_C, pg.Rect(0, resolution[1] - resolution[1]//3, resolution[0], resolution[1]//3))
+pg.draw.circle(playerBG, colours.BG1_C, (resolution[0]//2, 520), 50)
+pg.draw.circle(playerBG, (0, 0, 0), (resolution[0]//2, 520), 50, 2)
+
+playerRender = io.renderScheduler(sc, playerBG, musicPlayerUI, FPS, prof)
+
+# Clicks on the player screen go straight to the button under the mouse
+playerInput = io.eventDispatcher(profiler=prof)
+for element in musicPlayerUI:
+    if isinstance(element, (io.button, io.inputSlider)) or element is progBar:
+        playerInput.place(element)
+
+# ---- Track List ---- #
+# Only the rows in view are ever rendered, so this is cheap whatever the size of the playlist
+trackListView = io.trackList(10, 72, resolution[0] - 20, 300, len(playlist),
+                             labelFor=lambda i: os.path.splitext(playlist.name(i))[0] if playlist.name(i) else "(Removed)",
+                             action=selectSong)
+
+# Functions to add and remove the panels that sit over the player
+def showPanel(*widgets):
+    for widget in widgets:
+        # Keep the debug overlay on top
+        musicPlayerUI.insert(len(musicPlayerUI) - (statsOverlay in musicPlayerUI), widget)
+        playerInput.place(widget)
+    playerRender.invalidate()
+
+def hidePanel(*widgets):
+    for widget in widgets:
+        if widget in musicPlayerUI:
+            musicPlayerUI.remove(widget)
+            playerInput.remove(widget)
+    playerRender.invalidate()
+
+# Function to show or hide the track list
+def toggleTrackList():
+    if trackListView in musicPlayerUI:
+        hidePanel(trackListView)
     else:
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                running = False
+        closeSearch()
+        trackListView.setSelected(songInfo["ID"])
+        trackListView.jumpTo(songInfo["ID"], smooth=False)
+        showPanel(trackListView)
+
+# ---- Search ---- #
+searchBox = io.inputBox(10, 72, resolution[0] - 20, 32, prompt="Search title, artist, album or file")
+searchList = io.trackList(10, 108, resolution[0] - 20, 264,
+                          labelFor=lambda i: resultLabel(searchResults[i]),
+                          action=lambda i: playResult(i))
+
+# Function to get the text shown for a search result
+def resultLabel(path):
+    track = lib.get(path)
+    if track and track["Title"]:
+        return f"{track['Title']} - {track['Artist'] or 'Unknown Artist'}"
+    return os.path.basename(path)
+
+# Function to play a search result and close the search
+def playResult(index):
+    if index < len(searchResults) and searchResults[index] in playlist:
+        selectSong(playlist.find(searchResults[index]))
+    closeSearch()
+
+def openSearch():
+    global lastQuery
+    hidePanel(trackListView)
+    lastQuery = ""
+    searchBox.clear(active=True)
+    searchResults.clear()
+    searchList.setCount(0)
+    showPanel(searchBox, searchList)
+    playerInput.focus = searchBox
+
+def closeSearch():
+    if playerInput.focus is searchBox:
+        playerInput.focus = None
+    hidePanel(searchBox, searchList)
+
+# Function to re-run the search when the query changes. The index narrows down
+# the last results as more is typed, so this keeps up with typing.
+def updateSearch():
+    global lastQuery
+    if searchBox.text == lastQuery:
+        return
+    results = searcher.search(searchBox.text)
+    if results is None:
+        # Still indexing, try again next frame
+        return
+    lastQuery = searchBox.text
+    searchResults[:] = results
+    searchList.setCount(len(results))
+    searchList.setSelected(None)
+    searchList.jumpTo(0, smooth=False)
+
+# ---- Debug UI ---- #
+statsOverlay = overlay(prof, playerRender.clock, y=72)
+prof.nameWidgets({
+    "ver": ver, "errorText": errorText, "progBar": progBar, "minTime": minTime, "maxTime": maxTime,
+    "back_icon": back_icon, "forward_icon": forward_icon, "pause_icon": pause_icon,
+    "songNameTxt": songNameTxt, "artistNameTxt": artistNameTxt, "songIDTxt": songIDTxt, "artImage": artImage, "volumeSlider": volumeSlider,
+    "loopingTxt": loopingTxt, "shufflingTxt": shufflingTxt, "trackListView": trackListView,
+    "searchBox": searchBox, "searchList": searchList,
+    "statsOverlay": statsOverlay
+})
+
+# Function to turn profiling and its overlay on or off
+def setDebug(enabled):
+    global debug
+    debug = prof.enabled = enabled
+    if enabled and statsOverlay not in musicPlayerUI:
+        musicPlayerUI.append(statsOverlay)
+    elif not enabled and statsOverlay in musicPlayerUI:
+        musicPlayerUI.remove(statsOverlay)
+    playerRender.invalidate()
+
+# Function to note the first frame reaching the screen and say how long startup took.
+# The steps go in the profiler's trace either way, and are printed in debug mode.
+def reportStartup(shownAt=None):
+    global startup
+    if not startup:
+        return
+    startup.mark("First frame", shownAt)
+    report = startup.report(prof)
+    if debug:
+        print(report)
+    startup = None
+
+startup.mark("UI")
+
+# Only run the player when launched directly, so the benchmarks can import this module
+if __name__ == "__main__":
+    dataUnpacker()
+    setDebug(debug)
+    togglePause()
+    startup.mark("Config")
+
+    running = True
+    while running:
+        prof.beginFrame()
+        if libScan and libScan.finished:
+            finishScan()
+
+        # Draw library scan progress until there's something to play
+        if initialised and libScan and not playlist:
+            for event in pg.event.get():
+                if event.type == pg.QUIT:
+                    running = False
+                elif event.type == LIBRARY_CHANGED:
+                    applyChanges(event)
+
+            if libScan.walked:
+                scanPrompt.setText(f"Scanning library... {libScan.found} found, {libScan.done}/{libScan.total} read")
+            else:
+                scanPrompt.setText(f"Scanning library... {libScan.found} scanned")
+            scanBar.setValue(libScan.progress())
+
+            sc.fill(colours.BG1_C)
+            for obj in scanUI:
+                obj.draw(sc)
+            pg.display.flip()
+            reportStartup()
+            clock.tick(FPS)
+
+        # Draw regular UI
+        elif initialised:
+            for event in pg.event.get():
+                # Escape and Enter close the search before the search box sees them
+                if event.type == pg.KEYDOWN and searchBox in musicPlayerUI and event.key in (pg.K_ESCAPE, pg.K_RETURN):
+                    if event.key == pg.K_RETURN and searchResults:
+                        playResult(0)
+                    closeSearch()
+                    continue
+                if playerInput.dispatch(event):
+                    continue
+                elif event.type == pg.QUIT:
+                    running = False
+                elif event.type == pg.KEYDOWN:
+                    oldID = songInfo["ID"]
+                    if event.key == pg.K_RIGHT:
+                        try:
+                            nextSong()
+                        except Exception as e:
+                            errorText.setText(str(e))
+                            songInfo["ID"] = oldID + 1
+                    elif event.key == pg.K_LEFT and not songInfo["ID"]-1 < 0:
+                        try:
+                            nextSong(-1)
+                        except Exception as e:
+                            errorText.setText(str(e))
+                            songInfo["ID"] = oldID - 1
+                    elif event.key == pg.K_SPACE:
+                        togglePause()
+                    elif event.key == pg.K_F1:
+                        shuffling = not shuffling
+                        if shuffling:
+                            shuffler.moveTo(songInfo["ID"])
+                        queueNext()
+                        dataPacker()
+                    elif event.key == pg.K_F2:
+                        looping = not looping
+                        queueNext()
+                        dataPacker()
+                    elif event.key in (pg.K_UP, pg.K_DOWN):
+                        setVolume(round(volume * 100) + (5 if event.key == pg.K_UP else -5))
+                    elif event.key == pg.K_F3:
+                        setDebug(not debug)
+                        dataPacker()
+                    elif event.key == pg.K_TAB:
+                        toggleTrackList()
+                    elif event.key == pg.K_f and event.mod & pg.KMOD_CTRL:
+                        openSearch()
+                    elif event.key in (pg.K_PAGEUP, pg.K_PAGEDOWN) and trackListView in musicPlayerUI:
+                        trackListView.handleEvent(event)
+                    elif event.key == pg.K_F4 and debug:
+                        print("Trace written to", prof.dumpTrace(os.path.join("Data", f"trace-{int(time.time())}.json")))
+                elif event.type == playback.MUSIC_END:
+                    songEnded(event)
+                elif event.type == TRACK_READY:
+                    trackReady(event)
+                elif event.type == WAVEFORM_READY and event.path == waveformPath:
+                    progBar.setWaveform(event.peaks, event.rms)
+                elif event.type == GAIN_READY and event.path == songInfo.get("Path"):
+                    trackGain = event.gain
+                    updateVolume()
+                elif event.type == ART_READY and event.path == waveformPath:
+                    artImage.setImage(coverArt.keep(event.name, event.surface) if event.surface else coverArt.cached(event.name))
+                elif event.type == LIBRARY_CHANGED:
+                    applyChanges(event)
+                elif event.type == LIBRARY_LOADED:
+                    libraryLoaded(event)
+
+            if pg.time.get_ticks() - lastSave > SAVE_INTERVAL and not paused:
+                dataPacker()
+
+            # While the bar is being dragged, show where the song would jump to
+            shownPos = progBar.current_value / 100 * msLen if progBar.held else songPos()
+            hours, remainder = divmod(int(shownPos // 1000), 3600)
+            minutes, seconds = divmod(remainder, 60)
+            formatted_length = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+            # Configure variable UI. These only mark widgets dirty when something changed.
+            songNameTxt.setText(songInfo["SongName"])
+            artistNameTxt.setText(songInfo["SongArtist"])
+            # Configs from before the first song was played have no length yet
+            maxTime.setText(songInfo.get("Length", "00:00:00"))
+            minTime.setText(formatted_length)
+            shufflingTxt.setText(f"Shuffling [F1 Toggle]: {shuffling}")
+            loopingTxt.setText(f"Looping [F2 Toggle]: {looping}")
+
+            maxTime.setPos(x=sc.get_width() - maxTime.textSurface.get_width() - 2)
+            songNameTxt.centre(sc, yPos=100)
+            artistNameTxt.centre(sc, yPos=350)
+
+            if not progBar.held:
+                progBar.setValue(songPos() / msLen * 100)
+
+            trackListView.setSelected(songInfo["ID"])
+            trackListView.update()
+            if searchBox in musicPlayerUI:
+                updateSearch()
+                searchList.update()
+            if debug:
+                statsOverlay.update()
+
+            # Draws only what changed and caps the frame rate
+            playerRender.render()
+            reportStartup(playerRender.presentedAt)
+
+        # Draw initialisation UI
+        else:
+            for event in pg.event.get():
+                if event.type == pg.QUIT:
+                    running = False
+
+                for obj in initUI:
+                    obj.handleEvent(event)
+                    if isinstance(obj, io.inputBox):
+                        obj.update()
+
+                if event.type == pg.KEYDOWN:
+                    if event.key == pg.K_RETURN:
+                        # Several folders can be given, separated like in PATH
+                        roots = [root for root in fpBox.finalText.split(os.pathsep) if root]
+                        if roots and all(os.path.isdir(root) for root in roots):
+                            errorText.setText("")
+                            libraryRoots = roots
+                            playlistPath = roots[0]
+                            initialised = True
+                            songInfo["ID"] = -1
+                            startLibrary()
+                            dataPacker()
+
+                        else:
+                            errorText.setText("Error: Folder not found.")
+
+            sc.fill((20, 100, 20))
 
             for obj in initUI:
-                obj.handleEvent(event)
-                if isinstance(obj, io.inputBox):
-                    obj.update()
-
-            if event.type == pg.KEYDOWN:
-                if event.key == pg.K_RETURN:
-                    if os.path.exists(fpBox.finalText):
-                        errorText.setText("")
-                        playlistPath = fpBox.finalText
-                        initialised = True
-                        songInfo["ID"] = -1
-
-                    else:
-                        errorText.setText("Error: Folder not found.")
-
-        sc.fill((20, 100, 20))
-
-        for obj in initUI:
-            obj.draw(sc)
-
-    pg.display.flip()
-
-dataPacker()
-pg.quit()
\ No newline at end of file
+                obj.draw(sc)
+            pg.display.flip()
+            reportStartup()
+            clock.tick(FPS)
+
+    dataPacker(now=True)
+    history.close()
+    lib.close()
+    pg.quit()
\ No newline at end of file
@@ -0,0 +1,179 @@
+# Compact list of track paths for big playlists. Each folder is stored once, and
+# each track is just a folder number plus where its file name sits in one shared
+# blob of bytes. Paths are only turned back into strings when they're asked for.
+import os
+from array import array
+
+# Folder number of a removed track
+REMOVED = 0xFFFFFFFF
+
+# Marks in the lookup table: a slot never used, and one whose track has gone
+EMPTY = 0
+DELETED = 0xFFFFFFFF
+
+class pathTable:
+    def __init__(self, paths=()):
+        self.folders = []
+        self.folderIDs = {}
+        self.folderOf = array("I")
+        self.nameStart = array("I")
+        self.nameLength = array("H")
+        self.names = bytearray()
+        # Each track's hash(path), and an open addressing table of ID + 1 by hash.
+        # Finds a path without holding on to every path as a string, or an object per track.
+        self.hashes = array("q")
+        self.slots = array("I", bytes(4 * 8))
+        self.used = 0
+        self.live = 0
+        # Filled in one go, then the lookup table is built once at the end
+        for path in paths:
+            folder, start, length = self.store(path)
+            self.folderOf.append(folder)
+            self.nameStart.append(start)
+            self.nameLength.append(length)
+            self.hashes.append(hash(path))
+        self.live = len(self.folderOf)
+        self.resize()
+
+    def __len__(self):
+        return len(self.folderOf)
+
+    # Whether there's anything left to play
+    def __bool__(self):
+        return self.live > 0
+
+    def __iter__(self):
+        for ID in range(len(self)):
+            yield self[ID]
+
+    def __contains__(self, path):
+        return self.find(path) is not None
+
+    # The path of a track, or None if it has been removed
+    def __getitem__(self, ID):
+        folder = self.folderOf[ID]
+        if folder == REMOVED:
+            return None
+        start = self.nameStart[ID]
+        name = self.names[start:start + self.nameLength[ID]].decode("utf-8", "surrogateescape")
+        return os.path.join(self.folders[folder], name)
+
+    # Just the file name, without building the whole path
+    def name(self, ID):
+        if self.folderOf[ID] == REMOVED:
+            return None
+        start = self.nameStart[ID]
+        return self.names[start:start + self.nameLength[ID]].decode("utf-8", "surrogateescape")
+
+    # Point an ID at a new path (e.g. after a rename), or None to remove it
+    def __setitem__(self, ID, path):
+        old = self[ID]
+        if old is not None:
+            self.unindex(ID)
+            self.live -= 1
+        if path is None:
+            self.folderOf[ID] = REMOVED
+            return
+
+        folder, start, length = self.store(path)
+        self.folderOf[ID] = folder
+        self.nameStart[ID] = start
+        self.nameLength[ID] = length
+        self.hashes[ID] = hash(path)
+        self.index(ID)
+        self.live += 1
+
+    def append(self, path):
+        folder, start, length = self.store(path)
+        self.folderOf.append(folder)
+        self.nameStart.append(start)
+        self.nameLength.append(length)
+        self.hashes.append(hash(path))
+        self.index(len(self) - 1)
+        self.live += 1
+        return len(self) - 1
+
+    # Add a path's folder and name to the tables. Returns (folder, name start, name length).
+    def store(self, path):
+        folder, name = os.path.split(path)
+        folderID = self.folderIDs.get(folder)
+        if folderID is None:
+            folderID = self.folderIDs[folder] = len(self.folders)
+            self.folders.append(folder)
+        encoded = name.encode("utf-8", "surrogateescape")
+        start = len(self.names)
+        self.names += encoded
+        return folderID, start, len(encoded)
+
+    # Put an ID in the first free slot for its hash
+    def index(self, ID):
+        slots = self.slots
+        mask = len(slots) - 1
+        slot = self.hashes[ID] & mask
+        while slots[slot] not in (EMPTY, DELETED):
+            slot = (slot + 1) & mask
+        self.used += slots[slot] == EMPTY
+        slots[slot] = ID + 1
+        # Kept at most half full so probes stay short
+        if self.used * 2 > len(slots):
+            self.resize()
+
+    def unindex(self, ID):
+        slots = self.slots
+        mask = len(slots) - 1
+        slot = self.hashes[ID] & mask
+        while slots[slot] != ID + 1:
+            slot = (slot + 1) & mask
+        slots[slot] = DELETED
+
+    # Rebuild the table from the tracks still there, big enough for plenty more
+    def resize(self):
+        size = 8
+        while size < (self.live + 1) * 4:
+            size *= 2
+        slots = self.slots = array("I", bytes(4 * size))
+        mask = size - 1
+        self.used = 0
+        for ID, folder in enumerate(self.folderOf):
+            if folder != REMOVED:
+                slot = self.hashes[ID] & mask
+                while slots[slot] != EMPTY:
+                    slot = (slot + 1) & mask
+                slots[slot] = ID + 1
+                self.used += 1
+
+    # The ID of a path, or None if it isn't in the playlist
+    def find(self, path):
+        key = hash(path)
+        slots = self.slots
+        mask = len(slots) - 1
+        slot = key & mask
+        while slots[slot] != EMPTY:
+            found = slots[slot] - 1
+            if slots[slot] != DELETED and self.hashes[found] == key and self[found] == path:
+                return found
+            slot = (slot + 1) & mask
+        return None
+
+    # A copy that shares nothing with this table, for another thread to read while this one changes.
+    # Only arrays are copied, so it's quick even for a big playlist.
+    def copy(self):
+        table = pathTable()
+        table.folders = list(self.folders)
+        table.folderIDs = dict(self.folderIDs)
+        table.folderOf = array("I", self.folderOf)
+        table.nameStart = array("I", self.nameStart)
+        table.nameLength = array("H", self.nameLength)
+        table.names = bytearray(self.names)
+        table.hashes = array("q", self.hashes)
+        table.slots = array("I", self.slots)
+        table.used = self.used
+        table.live = self.live
+        return table
+
+    # The first track that hasn't been removed
+    def first(self):
+        for ID, folder in enumerate(self.folderOf):
+            if folder != REMOVED:
+                return ID
+        return None
@@ -0,0 +1,276 @@
+# History of what was played: when each play started, how long it was listened to
+# and whether it was skipped. Plays are handed to a worker thread, which appends
+# them in batches to a small binary log and keeps running totals per track, so
+# "most played" and "recently skipped" never mean reading the history back.
+# Once the log passes a size limit it's folded into a snapshot of the totals and
+# started again, so loading stays quick however many years of plays there are.
+# Tracks go by their library ID, which stays the same when a file is renamed or moved.
+import os
+import time
+import heapq
+import struct
+import threading
+from array import array
+from collections import deque
+
+from stateStore import atomicWrite
+
+HISTORY_LOG = os.path.join("Data", "history.log")
+HISTORY_SNAPSHOT = os.path.join("Data", "history.bin")
+
+# Log header: magic, generation. The snapshot names the generation of the log that
+# follows it, so a log already folded in when a compaction was cut short isn't counted twice.
+LOG_HEADER = struct.Struct("<4sI")
+LOG_MAGIC = b"HLG2"
+
+# One play in the log: library ID, start time, seconds listened, skipped
+PLAY = struct.Struct("<Idf?")
+
+# Snapshot header: magic, log generation, track count, recently skipped count.
+# Followed by the library ID, plays, skips and seconds listened of each track,
+# then the recently skipped IDs and when they were skipped.
+SNAPSHOT_HEADER = struct.Struct("<4sIII")
+SNAPSHOT_MAGIC = b"HST2"
+
+# Plays written at once, and the longest a play waits to be written (s)
+BATCH = 16
+FLUSH_INTERVAL = 60
+# Log size that gets it folded into the snapshot
+COMPACT_BYTES = 256 * 1024
+# How many tracks the "most played" and "recently skipped" lists hold
+TOP = 50
+
+class playHistory:
+    # "lib" turns IDs back into paths when the lists are asked for
+    def __init__(self, lib, logPath=HISTORY_LOG, snapshotPath=HISTORY_SNAPSHOT):
+        self.lib = lib
+        self.logPath = logPath
+        self.snapshotPath = snapshotPath
+
+        # The play going on now, only touched on the UI thread. "resumedAt" is None while paused.
+        self.playing = None
+        self.startedAt = 0
+        self.listened = 0
+        self.resumedAt = None
+
+        # Finished plays waiting for the worker
+        self.pending = []
+        self.closing = False
+        self.condition = threading.Condition()
+
+        # The worker's own: each track's row in the totals by ID, the totals, and the log
+        self.rows = {}
+        self.ids = array("I")
+        self.plays = array("I")
+        self.skips = array("I")
+        self.seconds = array("d")
+        self.skipped = deque(maxlen=TOP)
+        self.top = []
+        self.generation = 0
+        self.log = None
+        self.logSize = 0
+        # Log bytes a failed write left behind, tried again with the next batch
+        self.unwritten = b""
+
+        # The answers to the queries by ID, replaced whole so the UI thread can read them without waiting
+        self.mostPlayedList = []
+        self.recentlySkippedList = []
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # ---- UI thread ---- #
+    # A track started playing, by its library ID. Anything still playing counts as having finished.
+    def begin(self, trackID, paused=False):
+        self.end()
+        self.playing = trackID
+        self.startedAt = time.time()
+        self.listened = 0
+        self.resumedAt = None if paused else time.monotonic()
+
+    def setPaused(self, paused):
+        if self.playing is None:
+            return
+        if paused and self.resumedAt is not None:
+            self.listened += time.monotonic() - self.resumedAt
+            self.resumedAt = None
+        elif not paused and self.resumedAt is None:
+            self.resumedAt = time.monotonic()
+
+    # The current play is over. "skipped" if the listener moved on before it finished.
+    def end(self, skipped=False):
+        if self.playing is None:
+            return
+        listened = self.listened
+        if self.resumedAt is not None:
+            listened += time.monotonic() - self.resumedAt
+        with self.condition:
+            self.pending.append((self.playing, self.startedAt, listened, skipped))
+            if len(self.pending) >= BATCH:
+                self.condition.notify()
+        self.playing = None
+
+    # Swap the IDs in a list for paths, leaving out tracks that have left the library
+    def withPaths(self, entries, count):
+        paths = self.lib.pathsOf(entry[0] for entry in entries)
+        return [(paths[entry[0]],) + entry[1:] for entry in entries if entry[0] in paths][:count]
+
+    # The most played tracks, most first, as (path, plays, seconds listened)
+    def mostPlayed(self, count=TOP):
+        return self.withPaths(self.mostPlayedList, count)
+
+    # The tracks skipped lately, latest first, as (path, when it was skipped)
+    def recentlySkipped(self, count=TOP):
+        return self.withPaths(self.recentlySkippedList, count)
+
+    # Finish the current play and write everything still waiting, e.g. on exit
+    def close(self, timeout=5):
+        self.end()
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    # ---- Worker ---- #
+    # Add a play to its track's totals
+    def count(self, trackID, started, listened, skipped):
+        row = self.rows.get(trackID)
+        if row is None:
+            row = self.rows[trackID] = len(self.ids)
+            self.ids.append(trackID)
+            self.plays.append(0)
+            self.skips.append(0)
+            self.seconds.append(0)
+        self.seconds[row] += listened
+        if not skipped:
+            self.plays[row] += 1
+            return row
+        self.skips[row] += 1
+        # A track skipped again moves back to the front
+        if any(entry[0] == trackID for entry in self.skipped):
+            self.skipped = deque((entry for entry in self.skipped if entry[0] != trackID), maxlen=TOP)
+        self.skipped.append((trackID, started + listened))
+        return row
+
+    # Work out the answers to the queries again. Play counts only ever go up, so only
+    # the rows in "changed" can have joined the most played.
+    def publish(self, changed=None):
+        candidates = range(len(self.plays)) if changed is None else set(self.top) | changed
+        self.top = [row for row in heapq.nlargest(TOP, candidates, key=self.plays.__getitem__) if self.plays[row]]
+        self.mostPlayedList = [(self.ids[row], self.plays[row], self.seconds[row]) for row in self.top]
+        self.recentlySkippedList = list(reversed(self.skipped))
+
+    # Read the totals saved by the last compaction. Returns the generation of log that goes with them.
+    def loadSnapshot(self):
+        try:
+            with open(self.snapshotPath, "rb") as f:
+                magic, generation, count, skippedCount = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+                if magic != SNAPSHOT_MAGIC:
+                    return 0
+                columns = [array("I"), array("I"), array("I"), array("d"), array("I"), array("d")]
+                for column, length in zip(columns, (count, count, count, count, skippedCount, skippedCount)):
+                    column.fromfile(f, length)
+        except (OSError, EOFError, struct.error):
+            return 0
+
+        self.ids, self.plays, self.skips, self.seconds, skippedIDs, skippedWhen = columns
+        self.rows = {trackID: row for row, trackID in enumerate(self.ids)}
+        self.skipped = deque(zip(skippedIDs, skippedWhen), maxlen=TOP)
+        return generation
+
+    # Apply the plays in a log after its header. Returns where the last whole one ends.
+    def replay(self, data):
+        end = LOG_HEADER.size + (len(data) - LOG_HEADER.size) // PLAY.size * PLAY.size
+        for play in PLAY.iter_unpack(data[LOG_HEADER.size:end]):
+            self.count(*play)
+        return end
+
+    # Start an empty log of the current generation
+    def startLog(self):
+        atomicWrite(self.logPath, LOG_HEADER.pack(LOG_MAGIC, self.generation))
+        self.log = open(self.logPath, "ab")
+        self.logSize = LOG_HEADER.size
+
+    def load(self):
+        self.generation = self.loadSnapshot()
+        try:
+            with open(self.logPath, "rb") as f:
+                data = f.read()
+            magic, generation = LOG_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            magic = generation = None
+
+        try:
+            os.makedirs(os.path.dirname(self.logPath) or ".", exist_ok=True)
+            if magic == LOG_MAGIC and generation == self.generation:
+                end = self.replay(data)
+                # Drop anything a crash left half written, so new plays follow on from whole ones
+                with open(self.logPath, "r+b") as f:
+                    f.truncate(end)
+                self.log = open(self.logPath, "ab")
+                self.logSize = end
+            else:
+                self.startLog()
+        except OSError as e:
+            print(f"Couldn't open the play history: {e}")
+        self.publish()
+
+    # Append some finished plays to the log in one go and add them to the totals
+    def write(self, plays):
+        data = bytearray(self.unwritten)
+        changed = set()
+        for play in plays:
+            data += PLAY.pack(*play)
+            changed.add(self.count(*play))
+        self.publish(changed)
+
+        try:
+            if self.log is None:
+                raise OSError("the log isn't open")
+            self.log.write(data)
+            self.log.flush()
+        except OSError as e:
+            print(f"Couldn't save the play history: {e}")
+            self.unwritten = bytes(data)
+            return
+        self.unwritten = b""
+        self.logSize += len(data)
+        if self.logSize > COMPACT_BYTES:
+            self.compact()
+
+    # Save the totals as a new snapshot and start the next log, which leaves out
+    # every play so far. A crash in between leaves the old log, which the snapshot says to skip.
+    def compact(self):
+        skippedIDs = array("I", (trackID for trackID, _ in self.skipped))
+        skippedWhen = array("d", (when for _, when in self.skipped))
+        try:
+            atomicWrite(self.snapshotPath, SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.generation + 1, len(self.ids), len(self.skipped)) +
+                        self.ids.tobytes() + self.plays.tobytes() + self.skips.tobytes() + self.seconds.tobytes() +
+                        skippedIDs.tobytes() + skippedWhen.tobytes())
+            self.log.close()
+            self.log = None
+            self.generation += 1
+            self.startLog()
+        except OSError as e:
+            print(f"Couldn't compact the play history: {e}")
+
+    def run(self):
+        self.load()
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + FLUSH_INTERVAL
+                while len(self.pending) < BATCH and not self.closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                plays = self.pending
+                self.pending = []
+                closing = self.closing
+
+            if plays:
+                self.write(plays)
+            if closing:
+                if self.log:
+                    self.log.close()
+                return
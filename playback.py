@@ -0,0 +1,127 @@
+# Gapless playback on top of pygame's music stream. The next track is queued
+# while the current one plays, and track ends arrive as MUSIC_END events.
+# The position is kept on a clock of its own instead of asking the mixer, whose
+# get_pos only counts time spent playing since play() and knows nothing of seeks.
+import os
+import time
+import pygame as pg
+
+MUSIC_END = pg.USEREVENT + 1
+
+class player:
+    def __init__(self):
+        self.current = None
+        self.queued = None
+        self.paused = False
+        # Where in the track the clock was last set (s), and when it started running from
+        # there. "clockStart" is None while paused.
+        self.clockPos = 0
+        self.clockStart = None
+        pg.mixer.music.set_endevent(MUSIC_END)
+
+    def startClock(self, position):
+        self.clockPos = position
+        self.clockStart = None if self.paused else time.monotonic()
+
+    # How far into the current track playback is (s)
+    def position(self):
+        if self.clockStart is None:
+            return self.clockPos
+        return self.clockPos + time.monotonic() - self.clockStart
+
+    # What to hand the mixer: the preloaded file if there is one, otherwise the path
+    @staticmethod
+    def source(path, data):
+        if data is None:
+            return path, ""
+        data.seek(0)
+        return data, os.path.splitext(path)[1][1:].lower()
+
+    # Start a track straight away, dropping anything that was queued.
+    # "data" is an optional file object holding the already read track,
+    # "start" is where to start from in seconds.
+    # Raises pg.error if the track can't be played, and then nothing is playing.
+    def play(self, path, paused=False, data=None, start=0):
+        # Stopping the old track ourselves shouldn't look like it ended
+        pg.mixer.music.set_endevent()
+        try:
+            pg.mixer.music.stop()
+            pg.mixer.music.load(*self.source(path, data))
+            pg.mixer.music.play(start=start)
+            if paused:
+                pg.mixer.music.pause()
+        except pg.error:
+            self.current = None
+            self.queued = None
+            raise
+        finally:
+            pg.mixer.music.set_endevent(MUSIC_END)
+
+        self.current = path
+        self.queued = None
+        self.paused = paused
+        self.startClock(start)
+
+    def pause(self):
+        if not self.paused:
+            pg.mixer.music.pause()
+            self.clockPos = self.position()
+            self.paused = True
+            self.clockStart = None
+
+    def unpause(self):
+        if self.paused:
+            pg.mixer.music.unpause()
+            self.paused = False
+            # Once playback has run out the clock stays where it stopped
+            if self.current is not None:
+                self.clockStart = time.monotonic()
+
+    # Jump to a point in the current track (s). Codecs that can't seek in place are
+    # restarted from there, which drops the queued track, so check "queued" afterwards.
+    def seek(self, position):
+        if self.current is None:
+            return
+        try:
+            pg.mixer.music.set_pos(position)
+        except pg.error:
+            pg.mixer.music.set_endevent()
+            try:
+                pg.mixer.music.play(start=position)
+            except pg.error as e:
+                print(f"Couldn't seek in {self.current}: {e}")
+                return
+            finally:
+                pg.mixer.music.set_endevent(MUSIC_END)
+            if self.paused:
+                pg.mixer.music.pause()
+            self.queued = None
+        self.startClock(position)
+
+    # Line up the track to play when the current one ends. Replaces any queued track.
+    def queue(self, path, data=None):
+        if path == self.queued:
+            return
+        try:
+            pg.mixer.music.queue(*self.source(path, data))
+            self.queued = path
+        except pg.error as e:
+            print(f"Couldn't queue {path}: {e}")
+            self.queued = None
+
+    # Returns True if the queued track has taken over, False if playback ran out
+    # and None for events that aren't about the music.
+    def handleEvent(self, event):
+        if event.type != MUSIC_END:
+            return None
+
+        if self.queued and pg.mixer.music.get_busy():
+            self.current, self.queued = self.queued, None
+            self.startClock(0)
+            return True
+        # Nothing is playing any more, so stop the clock where the track ended
+        self.clockPos = self.position()
+        self.clockStart = None
+        self.current = None
+        self.queued = None
+        return False
@@ -0,0 +1,194 @@
+# Lightweight timers and counters for the hot paths, an on-screen overlay to show
+# them and a trace dump for offline analysis. Costs next to nothing while disabled.
+import json
+import time
+import functools
+from collections import deque
+import pygame as pg
+
+import ioMethods as io
+
+# Does nothing, handed out by timer() while profiling is off
+class nullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_TIMER = nullTimer()
+
+class timer:
+    def __init__(self, prof, name):
+        self.prof = prof
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.prof.record(self.name, self.start, time.perf_counter())
+        return False
+
+class profiler:
+    # "smoothing" is how much each new timing moves the running average
+    def __init__(self, enabled=False, smoothing=0.1, traceLength=100000):
+        self.enabled = enabled
+        self.smoothing = smoothing
+        self.averages = {}
+        self.last = {}
+        self.counters = {}
+        self.names = {}
+        self.marks = {}
+        self.trace = deque(maxlen=traceLength)
+        self.frameStart = time.perf_counter()
+        self.frameMs = 0
+
+    # Give widgets readable names for the overlay
+    def nameWidgets(self, widgets):
+        for name, widget in widgets.items():
+            self.names[id(widget)] = name
+
+    def nameOf(self, widget):
+        return self.names.get(id(widget), type(widget).__name__)
+
+    def timer(self, name):
+        return timer(self, name) if self.enabled else NULL_TIMER
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Store one timing, in perf_counter seconds
+    def record(self, name, start, end):
+        ms = (end - start) * 1000
+        average = self.averages.get(name)
+        self.averages[name] = ms if average is None else average + (ms - average) * self.smoothing
+        self.last[name] = ms
+        self.trace.append((name, start, end))
+
+    # Decorator that times and counts every call to a function
+    def timed(self, name):
+        def decorator(func):
+            # Keeps the function's own name and docstring for tracebacks
+            @functools.wraps(func)
+            def wrapped(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                self.count(name)
+                with timer(self, name):
+                    return func(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    # Start and stop timing something that spans several calls, e.g. a track switch
+    def mark(self, name):
+        if self.enabled:
+            self.marks[name] = time.perf_counter()
+
+    def finish(self, name):
+        start = self.marks.pop(name, None)
+        if start is not None:
+            end = time.perf_counter()
+            self.record(name, start, end)
+            return (end - start) * 1000
+        return None
+
+    def beginFrame(self):
+        self.frameStart = time.perf_counter()
+
+    # Called once the frame's work is done, before sleeping off the rest of it
+    def endFrame(self):
+        if self.enabled:
+            end = time.perf_counter()
+            self.frameMs = (end - self.frameStart) * 1000
+            self.record("Frame", self.frameStart, end)
+
+    # Write the trace in Chrome's trace event format (chrome://tracing, Perfetto)
+    def dumpTrace(self, path):
+        events = [
+            {"name": name, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6, "pid": 0, "tid": 0}
+            for name, start, end in list(self.trace)
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path
+
+# Times each step of starting up, from "start" (a perf_counter time) to the first frame
+class startupTimer:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.steps = []
+
+    # The step called "name" has just finished, or finished at "now" (a perf_counter time)
+    def mark(self, name, now=None):
+        now = time.perf_counter() if now is None else now
+        self.steps.append((name, self.last, now))
+        self.last = now
+
+    # Lines showing what each step took, and the steps in the profiler's trace if one is given
+    def report(self, prof=None):
+        lines = [f"{name:<28}{(end - start) * 1000:8.1f} ms" for name, start, end in self.steps]
+        lines.append(f"{'First frame after':<28}{(self.last - self.start) * 1000:8.1f} ms")
+        if prof:
+            for name, start, end in self.steps:
+                prof.record("Startup: " + name, start, end)
+        return "\n".join(lines)
+
+# On-screen readout of the profiler. Call update() every frame; it only re-renders
+# a few times a second.
+class overlay:
+    def __init__(self, prof, clock, x=0, y=0, width=220, rows=8, refresh=500):
+        self.prof = prof
+        self.clock = clock
+        self.rect = pg.Rect(x, y, width, 0)
+        self.rows = rows
+        self.refresh = refresh
+        self.lastRefresh = -refresh
+        self.fontSize = 18
+        self.surface = None
+        self.dirty = True
+
+    def lines(self):
+        prof = self.prof
+        switch = f"{prof.last['Track switch']:.1f} ms" if "Track switch" in prof.last else "-"
+        lines = [
+            f"Frame: {prof.frameMs:.2f} ms  FPS: {self.clock.get_fps():.0f}",
+            f"Last track switch: {switch}",
+        ]
+        lines += [f"{name}: {count}" for name, count in sorted(prof.counters.items())]
+
+        # The most expensive widgets
+        widgets = sorted(
+            ((ms, name) for name, ms in prof.averages.items() if name.startswith(("draw ", "event "))),
+            reverse=True
+        )
+        lines += [f"{name}: {ms:.3f} ms" for ms, name in widgets[:self.rows]]
+        return lines
+
+    def update(self):
+        now = pg.time.get_ticks()
+        if now - self.lastRefresh < self.refresh:
+            return
+        self.lastRefresh = now
+
+        # These strings change all the time, so don't fill the shared text cache with them
+        font = io.getFont(self.fontSize)
+        rendered = [font.render(line, True, (255, 255, 255)) for line in self.lines()]
+        lineHeight = font.get_linesize()
+        self.rect.height = lineHeight * len(rendered) + 4
+        self.surface = pg.Surface(self.rect.size, pg.SRCALPHA)
+        self.surface.fill((0, 0, 0, 170))
+        for i, line in enumerate(rendered):
+            self.surface.blit(line, (2, 2 + i * lineHeight))
+        self.dirty = True
+
+    def handleEvent(self, event):
+        pass
+
+    def draw(self, screen):
+        if self.surface:
+            return screen.blit(self.surface, self.rect)
+        return pg.Rect(self.rect.topleft, (0, 0))
@@ -0,0 +1,173 @@
+# Incremental search over the library. Every word of a track's filename, title,
+# artist and album goes into an inverted index, and the indexed words are kept
+# sorted so each word of a query matches every word it is a prefix of.
+import os
+import re
+import heapq
+import bisect
+import threading
+import unicodedata
+from operator import itemgetter
+
+# How much a match in each field is worth. A whole word match counts double.
+WEIGHTS = {"Title": 8, "Artist": 4, "Album": 2, "File": 1}
+
+# Above this many new words it's cheaper to re-sort the word list than insert them one by one
+RESORT_AFTER = 1000
+
+WORD = re.compile(r"[^\W_]+")
+
+# Lower case with accents stripped, so "Beyoncé" is found by "beyonce"
+def normalise(text):
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in text if not unicodedata.combining(char)).casefold()
+
+def words(text):
+    return WORD.findall(normalise(text)) if text else []
+
+class searchIndex:
+    def __init__(self):
+        # field -> word -> set of paths
+        self.fields = {field: {} for field in WEIGHTS}
+        # How many tracks use each word in any field, to know when it can leave the word list
+        self.wordCounts = {}
+        # path -> ((field, word) pairs, (mtime, size)) so changed files can be spotted and removed cleanly
+        self.docs = {}
+        self.vocab = []
+        self.newWords = []
+        # The last query's terms and scores. Typing more of a query can only narrow
+        # its results, so the next search only has to look at these tracks.
+        self.last = ([], None)
+        # Held while syncing, searches made in the meantime return None
+        self.lock = threading.Lock()
+        # (field, weight, exact) from the lowest score to the highest. Matches are applied
+        # in this order so each track ends up with its best score without comparing.
+        self.levels = sorted(
+            ((field, weight, exact) for field, weight in WEIGHTS.items() for exact in (False, True)),
+            key=lambda level: level[1] * (2 if level[2] else 1)
+        )
+
+    def add(self, track):
+        path = track["Path"]
+        if path in self.docs:
+            self.remove(path)
+
+        texts = {"File": os.path.splitext(os.path.basename(path))[0]}
+        for key in ("Title", "Artist", "Album"):
+            texts[key] = track.get(key)
+
+        entries = set()
+        for field, text in texts.items():
+            index = self.fields[field]
+            for word in words(text):
+                if (field, word) in entries:
+                    continue
+                entries.add((field, word))
+                index.setdefault(word, set()).add(path)
+                count = self.wordCounts.get(word, 0)
+                if not count:
+                    self.newWords.append(word)
+                self.wordCounts[word] = count + 1
+        self.docs[path] = (tuple(entries), (track.get("MTime"), track.get("Size")))
+
+    def remove(self, path):
+        doc = self.docs.pop(path, None)
+        if doc is None:
+            return
+        for field, word in doc[0]:
+            index = self.fields[field]
+            index[word].discard(path)
+            if not index[word]:
+                del index[word]
+            self.wordCounts[word] -= 1
+            if not self.wordCounts[word]:
+                del self.wordCounts[word]
+                position = bisect.bisect_left(self.vocab, word)
+                if position < len(self.vocab) and self.vocab[position] == word:
+                    del self.vocab[position]
+
+    # Bring the index in line with a list of library records, only re-indexing
+    # tracks that are new or have changed since they were last added
+    def sync(self, tracks):
+        with self.lock:
+            seen = set()
+            for track in tracks:
+                path = track["Path"]
+                seen.add(path)
+                doc = self.docs.get(path)
+                if doc is None or doc[1] != (track.get("MTime"), track.get("Size")):
+                    self.add(track)
+            for path in [path for path in self.docs if path not in seen]:
+                self.remove(path)
+            self.sortWords()
+            self.last = ([], None)
+
+    def sortWords(self):
+        newWords = [word for word in self.newWords if word in self.wordCounts]
+        self.newWords = []
+        if len(newWords) > RESORT_AFTER:
+            self.vocab = sorted(self.wordCounts)
+        else:
+            for word in newWords:
+                position = bisect.bisect_left(self.vocab, word)
+                if position == len(self.vocab) or self.vocab[position] != word:
+                    self.vocab.insert(position, word)
+
+    # Indexed words starting with "prefix"
+    def wordsFrom(self, prefix):
+        start = bisect.bisect_left(self.vocab, prefix)
+        end = bisect.bisect_left(self.vocab, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        return self.vocab[start:end]
+
+    # Score the tracks matching one term, only looking at "candidates" if given.
+    # The heavy lifting is all set and dict operations, which run in C.
+    def match(self, term, candidates=None):
+        matchedWords = self.wordsFrom(term)
+        keys = set(candidates) if candidates is not None else None
+        matches = {}
+        for field, weight, exact in self.levels:
+            index = self.fields[field]
+            score = weight * 2 if exact else weight
+            for word in ((term,) if exact else matchedWords):
+                paths = index.get(word)
+                if paths:
+                    matches.update(dict.fromkeys(paths if keys is None else paths & keys, score))
+        return matches
+
+    # Best matching paths first. Every word of the query has to match the start of
+    # some word of the track. Returns None while the index is being rebuilt.
+    def search(self, query, limit=100):
+        terms = words(query)
+        if not terms:
+            return []
+        if not self.lock.acquire(blocking=False):
+            return None
+
+        try:
+            self.sortWords()
+            lastTerms, lastScores = self.last
+            if lastScores is not None and terms == lastTerms:
+                scores = lastScores
+            else:
+                narrowing = lastScores is not None and len(terms) >= len(lastTerms) and all(
+                    term.startswith(lastTerm) for term, lastTerm in zip(terms, lastTerms)
+                )
+                # Narrowing down to a big share of the library costs more than starting over
+                candidates = lastScores if narrowing and len(lastScores) < len(self.docs) // 4 else None
+
+                scores = {}
+                # Longer terms tend to match fewer tracks, so they narrow things down fastest
+                for term in sorted(set(terms), key=len, reverse=True):
+                    matches = self.match(term, candidates)
+                    if candidates is not None and candidates is not lastScores:
+                        matches = {path: score + candidates[path] for path, score in matches.items()}
+                    scores = candidates = matches
+                    if not scores:
+                        break
+                self.last = (terms, scores)
+            return [path for path, _ in heapq.nlargest(limit, scores.items(), key=itemgetter(1))]
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.docs)
@@ -0,0 +1,193 @@
+# Shuffle order over playlist IDs. Plays every track once per round, keeps the
+# played tracks behind a cursor so you can go back, and saves to a small binary file.
+# The cursor moves every track, so it is saved with the rest of the state instead.
+# Playlist IDs are only good until the next launch, so the file holds library IDs.
+import os
+import random
+import struct
+from array import array
+
+SHUFFLE_PATH = os.path.join("Data", "shuffle.bin")
+
+# File header, 8 bytes: magic, order length. Followed by the library ID of each track
+# in the order, removed ones left out. The cursor is saved in cfg.json, not here.
+HEADER = struct.Struct("<4sI")
+MAGIC = b"SHF3"
+
+# Spread "new" IDs among "existing" ones at random, keeping the order of "existing".
+# Every arrangement comes up as often as inserting them one by one at random places
+# would give, but in one pass instead of an insert per ID.
+def scatter(existing, new):
+    new = list(new)
+    random.shuffle(new)
+    total = len(existing) + len(new)
+    spots = set(random.sample(range(total), len(new)))
+    existing = iter(existing)
+    new = iter(new)
+    return array("I", (next(new) if spot in spots else next(existing) for spot in range(total)))
+
+class shuffleOrder:
+    # "keys" is the library ID of each playlist ID
+    def __init__(self, keys=()):
+        self.keys = array("I", keys)
+        self.size = len(self.keys)
+        self.order = array("I")
+        self.position = array("I")
+        self.upcoming = None
+        # IDs whose files have gone, left out of every round
+        self.removed = set()
+        # Nothing has been played until the first moveTo
+        self.cursor = -1
+        # Whether the order needs saving again
+        self.changed = True
+        if self.size:
+            self.order = self.permutation()
+            self.index()
+
+    # A fresh Fisher-Yates shuffle of every ID, not starting on "avoid"
+    def permutation(self, avoid=None):
+        if self.removed:
+            order = array("I", (trackID for trackID in range(self.size) if trackID not in self.removed))
+        else:
+            order = array("I", range(self.size))
+        random.shuffle(order)
+        if avoid is not None and self.size > 1 and order[0] == avoid:
+            order[0], order[-1] = order[-1], order[0]
+        return order
+
+    # Rebuild the ID -> place in order lookup
+    def index(self):
+        self.position = array("I", [0]) * self.size
+        for i, trackID in enumerate(self.order):
+            self.position[trackID] = i
+
+    def swap(self, a, b):
+        if a == b:
+            return
+        self.order[a], self.order[b] = self.order[b], self.order[a]
+        self.position[self.order[a]] = a
+        self.position[self.order[b]] = b
+        self.changed = True
+
+    # Start the next round, using the order peekNext already promised if there is one
+    def newRound(self):
+        self.order = self.upcoming or self.permutation(avoid=self.current())
+        self.upcoming = None
+        self.index()
+        self.cursor = -1
+        self.changed = True
+
+    def current(self):
+        return self.order[self.cursor] if 0 <= self.cursor < len(self.order) else None
+
+    # The ID that comes next, without moving. The next round is only shuffled once it's needed.
+    def peekNext(self):
+        if len(self.removed) >= self.size:
+            return None
+        if self.cursor + 1 < len(self.order):
+            return self.order[self.cursor + 1]
+        if self.upcoming is None:
+            self.upcoming = self.permutation(avoid=self.current())
+        return self.upcoming[0]
+
+    # The next "count" IDs, without moving. Runs on into the next round if it has to.
+    def peekAhead(self, count):
+        if self.peekNext() is None:
+            return []
+        ahead = list(self.order[self.cursor + 1:self.cursor + 1 + count])
+        if len(ahead) < count and self.upcoming is not None:
+            ahead += self.upcoming[:count - len(ahead)]
+        return ahead
+
+    # The ID that was played before this one, or None at the start of the history
+    def peekBack(self):
+        return self.order[self.cursor - 1] if self.cursor > 0 else None
+
+    # Make an ID the current track. IDs already played this round move the cursor
+    # back to them, anything else is pulled forward to play next. Moving to the
+    # track peekNext promised at the end of a round starts the next round.
+    def moveTo(self, trackID):
+        if not 0 <= trackID < self.size or trackID in self.removed or trackID == self.current():
+            return
+        if self.cursor + 1 >= len(self.order) and self.upcoming and self.upcoming[0] == trackID:
+            self.newRound()
+        elif self.position[trackID] <= self.cursor:
+            self.cursor = self.position[trackID]
+            return
+
+        self.swap(self.cursor + 1, self.position[trackID])
+        self.cursor += 1
+
+    # Add tracks on the end of the playlist by their library IDs, each somewhere among
+    # the tracks still to come. The track peekNext promised for the next round stays first.
+    def grow(self, keys):
+        if not keys:
+            return
+        new = range(self.size, self.size + len(keys))
+        self.keys.extend(keys)
+        self.order = self.order[:self.cursor + 1] + scatter(self.order[self.cursor + 1:], new)
+        if self.upcoming is not None:
+            self.upcoming = self.upcoming[:1] + scatter(self.upcoming[1:], new)
+        self.size = len(self.keys)
+        self.index()
+        self.changed = True
+
+    # Take several IDs out at once, e.g. a deleted folder. The order is filtered
+    # and the lookup rebuilt once, however many there are.
+    def discardMany(self, trackIDs):
+        gone = {trackID for trackID in trackIDs if 0 <= trackID < self.size and trackID not in self.removed}
+        if not gone:
+            return
+        self.removed |= gone
+        # The cursor stays on the same track, or the one before it if that went
+        self.cursor -= sum(1 for trackID in gone if self.position[trackID] <= self.cursor)
+        self.order = array("I", (trackID for trackID in self.order if trackID not in gone))
+        if self.upcoming is not None:
+            self.upcoming = array("I", (trackID for trackID in self.upcoming if trackID not in gone))
+            # Same rule as permutation(): the next round doesn't start on the current track
+            if len(self.upcoming) > 1 and self.upcoming[0] == self.current():
+                self.upcoming[0], self.upcoming[-1] = self.upcoming[-1], self.upcoming[0]
+        self.index()
+        self.changed = True
+
+    # The saved form of the order: a header then the library IDs
+    def toBytes(self):
+        self.changed = False
+        keys = self.keys
+        return HEADER.pack(MAGIC, len(self.order)) + array("I", (keys[trackID] for trackID in self.order)).tobytes()
+
+    # Load a saved order for a playlist with these library IDs, or start a new one if it is
+    # missing or damaged. Tracks that have gone since are dropped, and new ones are spread
+    # among the tracks still to come.
+    @classmethod
+    def load(cls, keys, cursor=-1, path=SHUFFLE_PATH):
+        try:
+            with open(path, "rb") as f:
+                magic, length = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC:
+                    return cls(keys)
+                saved = array("I")
+                saved.fromfile(f, length)
+
+            shuffler = cls()
+            shuffler.keys = array("I", keys)
+            shuffler.size = len(shuffler.keys)
+            cursor = cursor if -1 <= cursor < length else -1
+            # Popped, so an ID saved twice only counts once
+            unplaced = {key: trackID for trackID, key in enumerate(shuffler.keys)}
+            order = array("I")
+            for place, key in enumerate(saved):
+                trackID = unplaced.pop(key, None)
+                if trackID is not None:
+                    order.append(trackID)
+                # The cursor stays on the same track, or the one before it if that went
+                elif place <= cursor:
+                    cursor -= 1
+            shuffler.order = order[:cursor + 1] + scatter(order[cursor + 1:], unplaced.values())
+            shuffler.index()
+        except (OSError, EOFError, ValueError, struct.error):
+            return cls(keys)
+
+        shuffler.cursor = cursor
+        shuffler.changed = len(order) != length or bool(unplaced)
+        return shuffler
@@ -0,0 +1,74 @@
+# Background, debounced saving of state files. Every write goes to a temp file
+# that is renamed over the real one, so a crash never leaves a half-written file.
+import os
+import threading
+import time
+
+# Write a whole file or nothing
+def atomicWrite(path, data):
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpPath, path)
+
+class stateStore:
+    # "delay" is how long things have to stay quiet before saving,
+    # "maxDelay" caps how long a steady stream of changes can put a save off
+    def __init__(self, delay=1.0, maxDelay=5.0):
+        self.delay = delay
+        self.maxDelay = maxDelay
+        self.pending = {}
+        self.firstChange = None
+        self.lastChange = None
+        self.condition = threading.Condition()
+        # Held while writing, so an older save can never land after a newer one
+        self.writeLock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Queue the new contents of a file. Later saves to the same path replace earlier ones.
+    def save(self, path, data):
+        with self.condition:
+            now = time.monotonic()
+            self.pending[path] = data
+            if self.firstChange is None:
+                self.firstChange = now
+            self.lastChange = now
+            self.condition.notify()
+
+    def takePending(self):
+        with self.condition:
+            writes = self.pending
+            self.pending = {}
+            self.firstChange = None
+        return writes
+
+    def write(self, writes):
+        for path, data in writes.items():
+            try:
+                atomicWrite(path, data)
+            except OSError as e:
+                print(f"Couldn't save {path}: {e}")
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # Wait for things to settle down
+                while self.pending:
+                    deadline = min(self.lastChange + self.delay, self.firstChange + self.maxDelay)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+            with self.writeLock:
+                self.write(self.takePending())
+
+    # Write anything still waiting straight away, e.g. on exit
+    def flush(self):
+        with self.writeLock:
+            self.write(self.takePending())
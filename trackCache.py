@@ -0,0 +1,119 @@
+# Local copies of the next few tracks, for libraries on network shares or slow disks.
+# A worker thread copies the tracks coming up onto local storage, and the loader
+# maps the copy into memory instead of reading the original. Copies are named by
+# path, mtime and size, so an edited original is never played stale, and the
+# least recently used ones are deleted to stay inside a byte budget.
+import os
+import mmap
+import shutil
+import hashlib
+import threading
+
+CACHE_DIR = os.path.join("Data", "cache")
+
+# Defaults for the settings in cfg.json: how much the copies can add up to, and how many tracks ahead to copy
+CACHE_BYTES = 512 * 1024 * 1024
+CACHE_AHEAD = 3
+
+class trackCache:
+    def __init__(self, folder=CACHE_DIR, maxBytes=CACHE_BYTES, ahead=CACHE_AHEAD):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.ahead = ahead
+        # The tracks coming up, soonest first, and the ones of those still to be copied
+        self.upcoming = []
+        self.wanted = []
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Where the copy of a file as it is now would be, or None if it's gone
+    def copyPath(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = f"{path}\0{stat.st_mtime}\0{stat.st_size}".encode("utf-8", "surrogateescape")
+        return os.path.join(self.folder, hashlib.sha1(key).hexdigest() + os.path.splitext(path)[1].lower())
+
+    # Whether a file is worth copying. Files on the same drive as the cache are already local.
+    def isRemote(self, path):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            return os.stat(path).st_dev != os.stat(self.folder).st_dev
+        except OSError:
+            return False
+
+    # The copy of a file mapped into memory, or None if there isn't one
+    def open(self, path):
+        if not self.maxBytes:
+            return None
+        copy = self.copyPath(path)
+        if copy is None:
+            return None
+        try:
+            with open(copy, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Mark it as recently used so trim() keeps it
+            os.utime(copy)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    # Ask for copies of the tracks coming up, soonest first. Only the first "ahead" are copied.
+    def prefetch(self, paths):
+        if not self.maxBytes:
+            return
+        with self.condition:
+            self.upcoming = list(paths)[:self.ahead]
+            self.wanted = list(self.upcoming)
+            self.condition.notify()
+
+    def copy(self, path):
+        copy = self.copyPath(path)
+        if copy is None or os.path.exists(copy) or not self.isRemote(path):
+            return
+        tmpPath = copy + ".tmp"
+        # Everything that touches the disk is in here, since an error would stop the worker for good
+        try:
+            # Never fill the budget with one huge file
+            if os.path.getsize(path) > self.maxBytes // 2:
+                return
+            shutil.copyfile(path, tmpPath)
+            os.replace(tmpPath, copy)
+            self.trim(keep={self.copyPath(upcoming) for upcoming in self.upcoming})
+        except OSError as e:
+            print(f"Couldn't cache {path}: {e}")
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+
+    # Delete the least recently used copies until they fit in the budget, never the ones in "keep"
+    def trim(self, keep=()):
+        copies = []
+        total = 0
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    total += stat.st_size
+                    if entry.path not in keep:
+                        copies.append((stat.st_mtime, stat.st_size, entry.path))
+        for _, size, path in sorted(copies):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Still mapped by the player on Windows, it can go next time
+                pass
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.wanted:
+                    self.condition.wait()
+                path = self.wanted.pop(0)
+            self.copy(path)
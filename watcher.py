@@ -0,0 +1,281 @@
+# Watches the library folders while the player runs and keeps the library up to date.
+# Uses inotify on Linux and falls back to polling the folders elsewhere. Each batch
+# of changes is written to the library, then posted as a LIBRARY_CHANGED event
+# holding (kind, path, oldPath) tuples, where kind is "Added", "Removed",
+# "Renamed" or "Changed".
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import pygame as pg
+
+from library import readAudio, walk
+from audioProbe import AUDIO_EXTENSIONS
+
+LIBRARY_CHANGED = pg.USEREVENT + 3
+
+# inotify flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT = struct.Struct("iIII")
+
+# How long to wait for more events before handling a batch, so a move's two halves arrive together (s)
+SETTLE = 0.2
+
+# Open inotify, or None where it isn't available
+def openInotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    return (libc, fd) if fd >= 0 else None
+
+# How a file looks right now: ((device, inode), mtime, size), or None if it's gone
+def fileState(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return ((stat.st_dev, stat.st_ino), stat.st_mtime, stat.st_size)
+
+# Work out what happened between two sets of {path: fileState}. A path that
+# disappeared while another with the same inode appeared was renamed.
+def compare(old, new):
+    gone = {state[0]: path for path, state in old.items() if path not in new}
+    changes = []
+    for path, state in new.items():
+        before = old.get(path)
+        if before is None:
+            oldPath = gone.pop(state[0], None)
+            changes.append(("Renamed", path, oldPath) if oldPath else ("Added", path, None))
+        elif before != state:
+            changes.append(("Changed", path, None))
+    changes += [("Removed", path, None) for path in gone.values()]
+    return changes
+
+# Hand a batch of changes to the UI thread
+def postChanges(roots, changes):
+    pg.event.post(pg.event.Event(LIBRARY_CHANGED, roots=list(roots), changes=changes))
+
+class folderWatcher:
+    # "interval" is how often to look through the folders when polling (s)
+    def __init__(self, roots, lib, interval=5.0):
+        self.roots = list(roots)
+        self.lib = lib
+        self.interval = interval
+        self.files = {}
+        # (device, inode) -> path, so a second link to a file already in the library is skipped
+        self.inodes = {}
+        # inotify watch descriptor -> the folder it watches
+        self.folders = {}
+        self.inotify = None
+        self.running = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    # Every audio file under the roots and its state
+    def snapshot(self):
+        return {path: ((stat.st_dev, stat.st_ino), stat.st_mtime, stat.st_size) for path, stat in walk(self.roots)}
+
+    def setFiles(self, files):
+        self.files = files
+        self.inodes = {state[0]: path for path, state in files.items()}
+
+    # Look through all the folders again
+    def rescan(self):
+        files = self.snapshot()
+        changes = compare(self.files, files)
+        self.setFiles(files)
+        self.apply(changes)
+
+    # Look again at just the paths inotify told us about
+    def recheck(self, paths):
+        old = {path: self.files[path] for path in paths if path in self.files}
+        new = {}
+        for path in paths:
+            state = fileState(path)
+            owner = self.inodes.get(state[0]) if state else None
+            if state and (owner is None or owner in paths):
+                new[path] = state
+
+        for path in paths:
+            state = self.files.pop(path, None)
+            if state and self.inodes.get(state[0]) == path:
+                del self.inodes[state[0]]
+        for path, state in new.items():
+            self.files[path] = state
+            self.inodes[state[0]] = path
+        self.apply(compare(old, new))
+
+    # Write a batch of changes to the library and tell the UI about them
+    def apply(self, changes):
+        applied = []
+        for kind, path, oldPath in changes:
+            try:
+                if kind in ("Added", "Changed"):
+                    track = readAudio(path)
+                    if track:
+                        self.lib.store(track)
+                    elif kind == "Changed":
+                        self.lib.remove(path)
+                        kind = "Removed"
+                    else:
+                        continue
+                elif kind == "Removed":
+                    self.lib.remove(path)
+                else:
+                    self.lib.rename(oldPath, path)
+            except OSError as e:
+                print(f"Couldn't update {path}: {e}")
+                continue
+            applied.append((kind, path, oldPath))
+
+        if applied:
+            self.lib.commit()
+            postChanges(self.roots, applied)
+
+    def run(self):
+        # The folders were just scanned, so only changes from here on count
+        self.setFiles(self.snapshot())
+        self.inotify = openInotify()
+        if self.inotify:
+            for root in self.roots:
+                if not self.watchFolder(root):
+                    # Most likely out of inotify watches, so poll instead
+                    os.close(self.inotify[1])
+                    self.inotify = None
+                    break
+
+        try:
+            if self.inotify:
+                self.watch()
+            else:
+                self.poll()
+        finally:
+            if self.inotify:
+                os.close(self.inotify[1])
+
+    def poll(self):
+        while self.running:
+            time.sleep(self.interval)
+            if self.running:
+                self.rescan()
+
+    # Add an inotify watch to a folder and every folder under it. False if one couldn't be added.
+    def watchFolder(self, folder):
+        libc, fd = self.inotify
+        seen = set()
+        for path, folders, _ in os.walk(folder, followlinks=True):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                folders[:] = []
+                continue
+            if (stat.st_dev, stat.st_ino) in seen:
+                folders[:] = []
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+
+            wd = libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                print(f"Couldn't watch {path}: {os.strerror(ctypes.get_errno())}")
+                return False
+            self.folders[wd] = path
+        return True
+
+    # Stop watching a folder that has gone, and everything under it
+    def unwatchFolder(self, folder):
+        libc, fd = self.inotify
+        prefix = os.path.join(folder, "")
+        for wd, path in list(self.folders.items()):
+            if path == folder or path.startswith(prefix):
+                libc.inotify_rm_watch(fd, wd)
+                del self.folders[wd]
+
+    def watch(self):
+        fd = self.inotify[1]
+        while self.running:
+            # Wake up now and then to notice stop()
+            if not select.select([fd], [], [], 1.0)[0]:
+                continue
+
+            # Keep reading until things go quiet so both halves of a move are in one batch
+            data = b""
+            while select.select([fd], [], [], SETTLE)[0]:
+                try:
+                    data += os.read(fd, 65536)
+                except BlockingIOError:
+                    break
+
+            paths = set()
+            overflowed = False
+            offset = 0
+            while offset + EVENT.size <= len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+                offset += EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.folders.pop(wd, None)
+                    continue
+                folder = self.folders.get(wd)
+                if folder is None:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if folder in self.roots:
+                        print(f"{folder} was removed or moved, no longer watching it")
+                    continue
+                if not name:
+                    continue
+
+                path = os.path.join(folder, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    # A whole folder came or went. Everything in it is looked at again,
+                    # so a folder moved within the library still counts as renames.
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        if not self.watchFolder(path):
+                            overflowed = True
+                        paths.update(found for found, _ in walk([path]))
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self.unwatchFolder(path)
+                        prefix = os.path.join(path, "")
+                        paths.update(known for known in self.files if known.startswith(prefix))
+                elif not mask & IN_CREATE and os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS:
+                    paths.add(path)
+
+            # Events were lost, so only a full look through the folders can be trusted
+            if overflowed:
+                self.rescan()
+            elif paths:
+                self.recheck(paths)
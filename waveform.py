@@ -0,0 +1,118 @@
+# Waveform overviews for the progress bar. A worker thread decodes a track, boils
+# it down to a peak and RMS level per slice with NumPy and posts a WAVEFORM_READY
+# event. Results are cached on disk by path and only recomputed once the file's
+# mtime or size changes, so a track is only ever decoded for this once.
+import os
+import queue
+import struct
+import hashlib
+import threading
+import pygame as pg
+
+from stateStore import atomicWrite
+
+# NumPy does the number crunching. Without it the progress bar just stays flat.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WAVEFORM_READY = pg.USEREVENT + 4
+
+WAVEFORM_DIR = os.path.join("Data", "waveforms")
+
+# How many slices a track is split into. The bar squeezes these to its width.
+SLICES = 1024
+
+# File header: magic, mtime, size, slice count. Followed by the peaks, then the RMS levels, a byte each.
+HEADER = struct.Struct("<4sdqH")
+MAGIC = b"WAV1"
+
+# Slices worked on at once, so a long track isn't copied to floats all in one go
+CHUNK = 64
+
+# Peak and RMS level (0-255) of each of "slices" equal parts of some samples
+def envelope(samples, slices=SLICES):
+    if not len(samples):
+        return bytes(slices), bytes(slices)
+
+    perSlice = -(-len(samples) // slices)
+    peaks = np.empty(slices, dtype=np.float32)
+    rms = np.empty(slices, dtype=np.float32)
+    for start in range(0, slices, CHUNK):
+        block = np.asarray(samples[start * perSlice:(start + CHUNK) * perSlice], dtype=np.float32)
+        if block.ndim > 1:
+            block = block.mean(axis=1)
+        # Pad to whole slices so the reshape is free
+        count = min(CHUNK, slices - start)
+        block = np.pad(np.abs(block), (0, count * perSlice - len(block))).reshape(count, perSlice)
+        peaks[start:start + count] = block.max(axis=1)
+        rms[start:start + count] = np.sqrt(np.square(block).mean(axis=1))
+
+    loudest = peaks.max() or 1
+    return (
+        (peaks / loudest * 255).astype(np.uint8).tobytes(),
+        (rms / loudest * 255).astype(np.uint8).tobytes()
+    )
+
+class waveformCache:
+    def __init__(self, folder=WAVEFORM_DIR):
+        self.folder = folder
+        self.requests = queue.Queue()
+        self.latest = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Where a track's overview is kept
+    def cachePath(self, path):
+        name = hashlib.sha1(path.encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(self.folder, name + ".peaks")
+
+    # The cached (peaks, rms) of a file, or None if it's missing or out of date
+    def load(self, path, mtime, size):
+        try:
+            with open(self.cachePath(path), "rb") as f:
+                data = f.read()
+            magic, cachedMTime, cachedSize, slices = HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if magic != MAGIC or (cachedMTime, cachedSize) != (mtime, size) or len(data) != HEADER.size + slices * 2:
+            return None
+        return data[HEADER.size:HEADER.size + slices], data[HEADER.size + slices:]
+
+    def save(self, path, mtime, size, peaks, rms):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            atomicWrite(self.cachePath(path), HEADER.pack(MAGIC, mtime, size, len(peaks)) + peaks + rms)
+        except OSError as e:
+            print(f"Couldn't cache the waveform of {path}: {e}")
+
+    # Decode a track and work out its overview
+    def compute(self, path):
+        sound = pg.mixer.Sound(path)
+        return envelope(pg.sndarray.samples(sound))
+
+    # Ask for a track's overview. Only the newest request is worked on.
+    def request(self, path):
+        if np is None:
+            return
+        self.latest = path
+        self.requests.put(path)
+
+    def run(self):
+        while True:
+            path = self.requests.get()
+            if path != self.latest:
+                continue
+
+            try:
+                stat = os.stat(path)
+                levels = self.load(path, stat.st_mtime, stat.st_size)
+                if levels is None:
+                    levels = self.compute(path)
+                    self.save(path, stat.st_mtime, stat.st_size, *levels)
+            except (OSError, pg.error) as e:
+                print(f"Couldn't work out the waveform of {path}: {e}")
+                continue
+
+            pg.event.post(pg.event.Event(WAVEFORM_READY, path=path, peaks=levels[0], rms=levels[1]))